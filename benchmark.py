@@ -0,0 +1,210 @@
+import argparse
+import csv
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+import completeness
+import data_processing
+import database_operations as db
+import file_operations
+import generate_fixtures
+import helper
+import metadata_cache
+import postgres_loader
+import run_report
+import schema_catalog
+
+logger = logging.getLogger(__name__)
+
+# the benchmark times every stage of the pipeline on synthetic IPEDS-shaped fixtures (see generate_fixtures.py)
+# at several scales and appends seconds, rows, rows per second and peak memory of every stage to a results CSV,
+# together with the git commit, so the results of two commits can be compared
+RESULT_COLUMNS = ['commit', 'timestamp', 'scale', 'years', 'chunk_size', 'stage', 'seconds', 'rows', 'rows_per_second', 'peak_mb']
+
+# function to get the current git commit, a '+' is added when the working tree has changes
+def get_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return commit + ('+' if dirty else '')
+    except Exception:
+        return 'unknown'
+
+# function to run a stage and measure its time and the peak resident memory of the process while it runs
+# the memory is sampled like the stages of the run report (see run_report.track_peak_rss), so the timings are not slowed down
+# the stage returns the number of rows it processed
+def run_stage(results, stage, func):
+    start = time.perf_counter()
+    with run_report.track_peak_rss() as peak:
+        try:
+            rows = func()
+        finally:
+            seconds = time.perf_counter() - start
+    peak_mb = peak['peak_mb']
+    results.append({'stage': stage, 'seconds': round(seconds, 4), 'rows': rows,
+                    'rows_per_second': round(rows / seconds) if seconds else 0, 'peak_mb': round(peak_mb, 1)})
+    logger.info(f"{stage}: {seconds:.3f} s, {rows} rows, peak {peak_mb:.1f} MB")
+
+# function to check if the postgres database of configurations.ini can be reached
+def postgres_available():
+    try:
+        with postgres_loader.get_engine().connect():
+            return True
+    except Exception as e:
+        logger.error(f"Postgres is not reachable, skipping the postgres stages: {e}")
+        return False
+
+# function to run all the stages on the fixtures of one scale
+# the stages run one after another on the frames of the previous stage, followed by an end to end run
+# of extract_and_save_data; with postgres the survey_table tables of the configured database are replaced
+def run_benchmark(work_folder, scale, years, chunk_size=0, postgres=False):
+    fixture_folder = os.path.join(work_folder, 'fixtures')
+    output_folder = os.path.join(work_folder, 'output', '<survey-name>')
+    shutil.rmtree(os.path.join(work_folder, 'output'), ignore_errors=True)
+    db_files = generate_fixtures.create_fixtures(fixture_folder, years, scale)
+    tables_to_merge = helper.get_tables_to_merge()
+    results = []
+    state = {}
+
+    def schema_discovery():
+        table_columns = []
+        state['year_columns'] = {}
+        for db_file, year in zip(db_files, years):
+            file_table_columns = db.get_table_columns(db_file, year)
+            table_columns.extend(file_table_columns)
+            state['year_columns'][year] = schema_catalog.merge_table_columns(file_table_columns)
+        state['columns'] = schema_catalog.merge_table_columns(table_columns)
+        state['column_types'] = schema_catalog.merge_column_types(table_columns)
+        state['dtypes'] = schema_catalog.merge_dtype_plan(table_columns)
+        return len(table_columns)
+
+    def extraction():
+        state['frames'] = []
+        rows = 0
+        for db_file, year in zip(db_files, years):
+            engine = db.connect_to_database(db_file)
+            try:
+                meta = metadata_cache.load_metadata(engine, year)
+                with engine.connect() as connection:
+                    for survey_table_name in meta['tables']:
+                        survey = survey_table_name[0].replace(' ', '').split('(')[0]
+                        table_name = survey_table_name[1].upper()
+                        if year in tables_to_merge['year'].values and table_name in tables_to_merge['table_to_skip'].values:
+                            continue
+                        survey_table = survey + '_' + re.sub(r'\d{2,}', '', table_name)
+                        query, table_to_skip, value_mappings = data_processing.get_table_query(meta, year, table_name, tables_to_merge)
+                        dtypes = data_processing.get_table_dtypes(meta, survey_table, table_to_skip, state['dtypes'])
+                        for df in data_processing.read_table_chunks(connection, query, table_name, table_to_skip, chunk_size, dtypes):
+                            state['frames'].append((year, survey, survey_table, df, value_mappings))
+                            rows += len(df)
+            finally:
+                engine.dispose()
+        return rows
+
+    def label_decoding():
+        frames = []
+        for year, survey, survey_table, df, value_mappings in state['frames']:
+            labels = data_processing.decode_labels(df, value_mappings)
+            frames.append((year, survey, survey_table, data_processing.assemble_frame(df, labels, year,
+                                                                                      state['year_columns'][year][survey_table],
+                                                                                      state['column_types'].get(survey_table, {}))))
+        state['frames'] = frames
+        return sum(len(df) for year, survey, survey_table, df in frames)
+
+    def csv_writing():
+        shards = []
+        for year, survey, survey_table, df in state['frames']:
+            csv_path = file_operations.get_shard_path(output_folder.replace('<survey-name>', survey), year,
+                                                      survey_table.split('_', 1)[1] + '.csv')
+            if csv_path not in shards:
+                file_operations.create_shard(csv_path, state['year_columns'][year][survey_table])
+                shards.append(csv_path)
+            df.to_csv(csv_path, index=False, header=False, mode='a', columns=state['year_columns'][year][survey_table])
+        file_operations.create_csv_files(output_folder, years, state['columns'])
+        return sum(len(df) for year, survey, survey_table, df in state['frames'])
+
+    def postgres_loading():
+        # every year is loaded into a staging table and swapped in, like extract_and_save_data does
+        staged = []
+        for year, survey, survey_table, df in state['frames']:
+            if (survey_table, year) not in staged:
+                postgres_loader.drop_staging(survey_table, year)
+                staged.append((survey_table, year))
+            postgres_loader.copy_partition(df, survey_table, year, state['year_columns'][year][survey_table], staging=True,
+                                           column_types=state['column_types'].get(survey_table, {}))
+        for survey_table, year in staged:
+            postgres_loader.swap_partition(survey_table, year)
+        return sum(len(df) for year, survey, survey_table, df in state['frames'])
+
+    def counts():
+        units = {}
+        for year, survey, survey_table, df in state['frames']:
+            unit = units.setdefault((year, survey_table), {'year': year, 'survey_table': survey_table})
+            completeness.add_counts(unit, df)
+        completeness.get_counts(list(units.values()), state['columns'])
+        return sum(len(df) for year, survey, survey_table, df in state['frames'])
+
+    def end_to_end():
+        shutil.rmtree(os.path.join(work_folder, 'output'), ignore_errors=True)
+        rows = 0
+        for db_file, year in zip(db_files, years):
+            units = data_processing.extract_and_save_data(db_file, year, True, postgres, output_folder, tables_to_merge,
+                                                          columnList = state['columns'], yearColumns = state['year_columns'][year],
+                                                          chunk_size = chunk_size,
+                                                          columnTypes = state['column_types'], dtypePlan = state['dtypes'])
+            rows += sum(unit['counts']['rows'] for unit in units or [] if unit['status'] == 'done')
+        file_operations.create_csv_files(output_folder, years, state['columns'])
+        return rows
+
+    run_stage(results, 'schema discovery', schema_discovery)
+    run_stage(results, 'extraction', extraction)
+    run_stage(results, 'label decoding', label_decoding)
+    run_stage(results, 'csv writing', csv_writing)
+    if postgres:
+        run_stage(results, 'postgres loading', postgres_loading)
+    run_stage(results, 'counts', counts)
+    state.pop('frames')
+    run_stage(results, 'end to end', end_to_end)
+    return results
+
+# function to append the results of a run to the results CSV, the header is written for a new file
+def save_results(results_path, rows):
+    new_file = not os.path.isfile(results_path)
+    with open(results_path, 'a', newline='') as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IPEDS pipeline on synthetic fixtures")
+    parser.add_argument('--scales', default='500,2000,8000', help="comma separated numbers of institutions")
+    parser.add_argument('--years', default='2008,2010,2020,2021', help="comma separated years of the fixtures")
+    parser.add_argument('--chunk-size', type=int, default=0, help="ChunkSize used to read the tables")
+    parser.add_argument('--postgres', action='store_true', help="also load the postgres database of configurations.ini")
+    parser.add_argument('--work-folder', default='benchmark_data', help="folder for the fixtures and the outputs")
+    parser.add_argument('--output', default='benchmark_results.csv', help="CSV file the results are appended to")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s, %(name)s %(levelname)s %(message)s', level=logging.WARNING,
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    logger.setLevel(logging.INFO)
+    years = args.years.split(',')
+    postgres = args.postgres and postgres_available()
+    commit = get_commit()
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        logger.info(f"Benchmarking {scale} institutions for {args.years}")
+        results = run_benchmark(os.path.join(args.work_folder, str(scale)), scale, years, args.chunk_size, postgres)
+        save_results(args.output, [dict(result, commit=commit, timestamp=timestamp, scale=scale, years=args.years,
+                                        chunk_size=args.chunk_size) for result in results])
+    postgres_loader.dispose_engine()
+    logger.info(f"Results appended to {args.output}")
+
+if __name__ == "__main__":
+    main()
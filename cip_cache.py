@@ -0,0 +1,54 @@
+import logging
+import os
+import openpyxl
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+logger = logging.getLogger(__name__)
+
+# the CIP workbooks are parsed once: the parsed sheet is cached as a pickle named by the sha256 of
+# the workbook, <cache folder>/<sha256>.pkl, so a workbook that is seen again is read from the cache
+# with exactly the values and dtypes of the parse, columns with numbers and text included
+
+# function to read the first sheet of a CIP workbook with the streaming read-only reader of openpyxl
+# the cells are converted and parsed by the TextParser of pandas like read_excel(dtype={'CIPCode': str}) does,
+# so e.g. a CIPFamily of '01' is read as the number 1 and the CIP tables keep their column types
+def read_workbook(workbook_path):
+    workbook = openpyxl.load_workbook(workbook_path, read_only=True, data_only=True)
+    try:
+        data = [[_convert_cell(value) for value in row] for row in workbook.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+    # the empty rows at the end of the sheet are dropped, like read_excel does
+    while data and all(value == '' for value in data[-1]):
+        data.pop()
+    return TextParser(data, header=0, dtype={'CIPCode': str}).read()
+
+# function to convert a cell value like the openpyxl reader of read_excel: empty cells are '' and whole numbers int
+def _convert_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+# function to get the parsed CIP workbook, from the cache when the workbook with this checksum was parsed before
+def read_cips(workbook_path, checksum, cache_folder=None):
+    cache_path = os.path.join(cache_folder, checksum + '.pkl') if cache_folder and checksum else None
+    if cache_path and os.path.isfile(cache_path):
+        logger.info(f"CIPs of {workbook_path} read from the cache {cache_path}")
+        return pd.read_pickle(cache_path)
+    df = read_workbook(workbook_path)
+    if cache_path:
+        # workers parsing two copies of a workbook write their own temporary file
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_folder, exist_ok=True)
+            df.to_pickle(temp_path)
+            os.replace(temp_path, cache_path)
+        except Exception as e:
+            # the workbook is parsed again next time
+            logger.error(f"An error occurred while caching the CIPs of {workbook_path}: {e}")
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+    return df
@@ -0,0 +1,38 @@
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# completeness statistics of the extracted data, gathered while the frames are written
+# every unit of the run manifest keeps {'rows': total rows, 'not_null': {column: non-null count}},
+# so counts.csv covers the skipped units as well and needs no postgres round trips
+
+# function to add the counts of a dataframe (or a chunk of it) to the counts of its unit
+def add_counts(unit, df):
+    counts = unit.setdefault('counts', {'rows': 0, 'not_null': {}})
+    counts['rows'] += len(df)
+    not_null = counts['not_null']
+    # counted column by column, a frame of sparse and dense columns cannot be counted as a whole
+    for column, values in df.items():
+        not_null[column] = not_null.get(column, 0) + int(values.count())
+
+# function to build the counts of every survey_table, year and column from the units of the run
+# a column a year does not have counts as 0 non-null values, like the null column of a postgres table
+# rows are ordered by survey_table (in columnList order), column name and year descending
+def get_counts(units, columnList = {}):
+    units_by_survey_table = {}
+    for unit in units:
+        units_by_survey_table.setdefault(unit['survey_table'], []).append(unit)
+
+    rows = []
+    for survey_table_name in columnList.keys():
+        survey_table_units = sorted(units_by_survey_table.get(survey_table_name, []), key=lambda unit: unit['year'], reverse=True)
+        columns = {}
+        for unit in survey_table_units:
+            columns.update(dict.fromkeys(unit['counts']['not_null']))
+        # same order as the column names in postgres: case insensitive, '_' before digits and letters
+        for column in sorted(columns, key=lambda column: column.lower().replace('_', ' ')):
+            for unit in survey_table_units:
+                rows.append([unit['year'], column, unit['counts']['rows'], unit['counts']['not_null'].get(column, 0), survey_table_name])
+        logger.info(f"Count data for {survey_table_name} added to the dataframe")
+    return pd.DataFrame(rows, columns=['year', 'column_name', 'total_count', 'count_not_nulls', 'survey_table_name'])
@@ -1,123 +1,476 @@
 import os
 import re
+import shutil
+import numpy as np
 import pandas as pd
 import logging
+import queue
+import threading
+import completeness
 import database_operations as db
-import sqlalchemy as sa
+import file_operations
+import manifest
+import metadata_cache
+import parquet_writer
+import postgres_loader
+import run_report
 
 logger = logging.getLogger(__name__)
 
-def extract_and_save_data(db_file, year, create_csv, create_postgres_tables, output_folder, tables_to_merge, columnList={}):
+# function to extract the tables of a year and save them to the CSV shards and/or postgres
+# units already done according to manifest_units are skipped, the returned units are recorded
+# in the run manifest by the caller; None is returned when the Access file could not be read
+# with a profile_folder every survey_table is profiled with cProfile and its profile written to the folder
+# with pipeline = {'readers', 'writers', 'queue_size'} the tables are read, decoded and written concurrently,
+# see save_tables_pipelined, otherwise they are processed one after another
+# the columns of every survey_table are converted to the dtypes of its dtypePlan as they are read, see schema_catalog.merge_dtype_plan
+# yearColumns has the columns of the survey_tables in this year alone, the units, the CSV shards and postgres follow them,
+# and the Parquet partitions get the schema of the columnList of all the years
+def extract_and_save_data(db_file, year, create_csv, create_postgres_tables, output_folder, tables_to_merge, columnList={}, chunk_size=0,
+                          checksum=None, manifest_units={}, create_parquet=False, parquet_folder=None, columnTypes={},
+                          profile_folder=None, pipeline=None, dtypePlan={}, yearColumns={}):
     engine = db.connect_to_database(db_file)
     if engine is None:
-        return
+        return None
+    outputs = (['csv'] if create_csv else []) + (['postgres'] if create_postgres_tables else []) + (['parquet'] if create_parquet else [])
+    units = []
+    tasks = []
+    if profile_folder and pipeline:
+        # cProfile only sees the thread it is enabled in
+        logger.warning("Profiling is not available with the pipeline, the tables are not profiled")
+        profile_folder = None
+    profilers = {} if profile_folder else None
+    # the metadata tables are read once for the year, the time is recorded on the first table extracted
+    metadata_stages = {}
     try:
-        survey_table_names = db.get_table_names(engine, year)
-        postgres_engine = db.connect_to_ipeds_database()
-        for survey_table_name in survey_table_names:
+        with run_report.measure(metadata_stages, 'metadata lookup'):
+            meta = metadata_cache.load_metadata(engine, year)
+        for survey_table_name in meta['tables']:
             survey = survey_table_name[0].replace(' ', '').split('(')[0]
             table_name = survey_table_name[1].upper()
             # remove more than 2 consecutive digits from the table name
             table_name_without_year = re.sub(r'\d{2,}', '', table_name)
-            with engine.connect() as connection:
-                logger.debug(f"Getting varname from vartable for {table_name}")
-                query = f"select varname from vartable{year[-2:]} where TableName = '{table_name}' and format = 'Disc'"
-                varnames = [row[0].upper().replace(' ', '') for row in connection.execute(sa.text(query))]
-                logger.debug(f"Got varname from vartable for {table_name}")
-                table_to_skip = None
-                # Create a pandas df for the table along with the column names
-                logger.debug(f"Reading data from {table_name}")
-                if year in tables_to_merge['year'].values:
-                    if table_name in tables_to_merge['table_to_skip'].values:
-                        continue
-                    elif table_name in tables_to_merge['table_to_merge_into'].values:
-                        table_to_skip = tables_to_merge.loc[tables_to_merge['table_to_merge_into'] == table_name,
-                                                           'table_to_skip'].iloc[0]
-                        query = f"SELECT * from {table_name} inner join {table_to_skip} on {table_name}.UNITID = {table_to_skip}.UNITID"
-                        df = pd.read_sql(query, connection)
-                        # drop table_to_skip.UNITID to UNITID
-                        df.rename(columns={table_to_skip + '.UNITID': 'UNITID'}, inplace=True)
-                        df.rename(columns={table_name + '.UNITID': 'UNITID'}, inplace=True)
-                        # remove duplicate columns
-                        df = df.loc[:, ~df.columns.duplicated()]
-                        query = f"select varname from vartable{year[-2:]} where TableName = '{table_to_skip}' and format = 'Disc'"
-                        new_varnames = [row[0].upper().replace(' ', '') for row in connection.execute(sa.text(query))]
-                        varnames.extend(new_varnames)
-                    else:
-                        query = f"SELECT * FROM {table_name}"
-                        df = pd.read_sql(query, connection)
-                else:
-                    query = f"SELECT * FROM {table_name}"
-                    df = pd.read_sql(query, connection)
-
-                logger.debug(f"Created a pandas dataframe for {table_name}")
-
-                # convert all the df column names to Upper case
-                if not df.columns.str.isupper().all():
-                    df.columns = df.columns.str.upper()
-
-                for varname in varnames:
-                    if table_to_skip is None:
-                        query = f"select codevalue, valuelabel from valuesets{year[-2:]} where tablename = '{table_name}' and varname = '{varname}'"
-                    else:
-                        query = f"select codevalue, valuelabel from valuesets{year[-2:]} where tablename in ('{table_name}','{table_to_skip}') and varname = '{varname}'"
-                    
-                    value_mapping = {row[0]: row[1] for row in connection.execute(sa.text(query))}
-                    logger.debug(f"Created a dictionary of codevalue and valuelabel for {varname} in {table_name}")
-                    # get the column index of the varname
-                    varname_index = df.columns.get_loc(varname)
-                    # map the codevalue to valuelabel and insert the new column after the varname column
-                    df.insert(varname_index + 1, varname + '_label', df[varname].astype(str).map(value_mapping))
-                    logger.debug(f"Mapped the codevalue to valuelabel for {varname} in {table_name}")
-
-                df.insert(0, 'Year', year)
-                logger.debug(f"Added Year column to the dataframe for {year}")
-
-                # Write the df to CSV file
-                output_destination = output_folder.replace('<survey-name>', survey)
-                file_name = table_name_without_year + '.csv'
-                csv_path = os.path.join(output_destination, file_name)
-                logger.debug(f"Writing data to CSV file {file_name} for {year}")
-
-                new_columns = []
-                # if df does not have any columns from columnList, then add the columns to the df with empty values
-                if not all(elem in df.columns for elem in columnList[survey + '_' + table_name_without_year]):
-                    for column in columnList[survey + '_' + table_name_without_year]:
-                        if column not in df.columns:
-                            new_columns.append(column)
-                df = pd.concat([df, pd.DataFrame(columns=new_columns)], axis=1)
-                if(create_csv):
-                    df.to_csv(csv_path, index=False, header=False, mode='a',
-                            columns=columnList[survey + '_' + table_name_without_year])
-                    logger.info(f"Data written to CSV file {file_name} for {year}")
-                if(create_postgres_tables):
-                    # write the df data into postgres table
-                    df.to_sql(survey + '_' + table_name_without_year, postgres_engine, if_exists='append', index=False)
-                    logger.info(f"Data written to postgres table {survey + '_' + table_name_without_year} for {year}")
+            survey_table = survey + '_' + table_name_without_year
+            if year in tables_to_merge['year'].values and table_name in tables_to_merge['table_to_skip'].values:
+                continue
+            key = manifest.unit_key(year, survey_table)
+            table_columns = yearColumns.get(survey_table, columnList[survey_table])
+            if any(unit['survey_table'] == survey_table for unit in units):
+                # a second table of the year with the same survey_table is appended to the same unit
+                unit = next(unit for unit in units if unit['survey_table'] == survey_table)
+                if unit['status'] in ('skipped', 'failed'):
+                    continue
+            elif manifest.is_unit_done(manifest_units, key, checksum, table_columns, outputs):
+                logger.info(f"Skipping {table_name} for {year}, already processed")
+                units.append(dict(manifest_units[key], status='skipped'))
+                continue
+            else:
+                unit = {'year': year, 'survey': survey, 'table': table_name, 'survey_table': survey_table, 'checksum': checksum,
+                        'columns': manifest.columns_hash(table_columns), 'outputs': {}, 'status': 'started',
+                        'stages': metadata_stages}
+                metadata_stages = {}
+                units.append(unit)
+            try:
+                task = get_table_task(meta, year, survey, table_name, tables_to_merge, create_csv, create_postgres_tables,
+                                      output_folder, table_columns, unit, create_parquet, parquet_folder,
+                                      columnTypes.get(survey_table, {}), dtypePlan, columnList[survey_table])
+                if pipeline:
+                    tasks.append(task)
+                    continue
+                with run_report.profile(profilers, survey_table):
+                    save_table(engine, task, chunk_size)
+                unit['status'] = 'done'
+            except Exception as e:
+                logger.error(f"An error occurred while extracting {table_name} for {year}: {e}")
+                unit['status'] = 'failed'
+        if tasks:
+            save_tables_pipelined(engine, tasks, chunk_size, **pipeline)
+        logger.info(f"{meta['queries']} queries sent to the Access database for {year}")
+        if profilers:
+            run_report.dump_profiles(profilers, profile_folder, year)
+        return units
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
+        return None
     finally:
         engine.dispose()
         logger.info(f"Connection closed after extracting data for {year}")
 
+# function to prepare the extraction of one table of a unit
+# the task keeps the query, the value mappings and the outputs of the table while it goes through the stages
+# columns are those of the year, parquet_columns those of all the years (the columns of the year by default)
+def get_table_task(meta, year, survey, table_name, tables_to_merge, create_csv, create_postgres_tables, output_folder, columns,
+                   unit, create_parquet=False, parquet_folder=None, column_types={}, dtypePlan={}, parquet_columns=None):
+    table_name_without_year = re.sub(r'\d{2,}', '', table_name)
+    task = {'year': year, 'survey': survey, 'table_name': table_name, 'table_name_without_year': table_name_without_year,
+            'survey_table': survey + '_' + table_name_without_year, 'columns': columns, 'column_types': column_types, 'unit': unit,
+            'parquet_columns': parquet_columns if parquet_columns is not None else columns,
+            'create_csv': create_csv, 'create_postgres_tables': create_postgres_tables, 'create_parquet': create_parquet,
+            'output_folder': output_folder, 'parquet_folder': parquet_folder, 'state': 'pending', 'failed': False}
+    with run_report.measure(unit.setdefault('stages', {}), 'metadata lookup'):
+        task['query'], task['table_to_skip'], task['value_mappings'] = get_table_query(meta, year, table_name, tables_to_merge)
+    task['dtypes'] = get_table_dtypes(meta, task['survey_table'], task['table_to_skip'], dtypePlan)
+    # the Parquet schema follows the plan of the survey_table alone, so it is the same in every year
+    task['dtype_plan'] = dtypePlan.get(task['survey_table'], {})
+    meta['queries'] += 1
+    return task
+
+# function to get the dtypes of the columns of a table from the dtype plan
+# the columns of a table merged into it keep the dtypes of the survey_table of the merged table
+def get_table_dtypes(meta, survey_table, table_to_skip, dtypePlan):
+    dtypes = dict(dtypePlan.get(survey_table, {}))
+    if table_to_skip is not None:
+        for survey, table_name in meta['tables']:
+            if table_name.upper() == table_to_skip.upper():
+                merged_survey_table = survey.replace(' ', '').split('(')[0] + '_' + re.sub(r'\d{2,}', '', table_name.upper())
+                for column, dtype in dtypePlan.get(merged_survey_table, {}).items():
+                    dtypes.setdefault(column, dtype)
+    return dtypes
+
+# function to extract one table of a year and write it to the CSV shard and/or the postgres table
+# the first table of a unit replaces the rows an earlier run wrote for the year, later ones append to them
+def save_table(engine, task, chunk_size):
+    with engine.connect() as connection:
+        open_outputs(task)
+        try:
+            for df in read_task_chunks(connection, task, chunk_size):
+                write_chunk(task, decode_chunk(task, df))
+            close_outputs(task)
+        except Exception:
+            abort_outputs(task)
+            raise
+
+# function to extract the tables of a year in a pipeline of threads on bounded queues:
+# reader threads fetch the chunks of the tables, one decode thread maps the labels and a pool of writer threads
+# writes the frames to the outputs, so the Access reads overlap with the CSV, postgres and Parquet writes
+# all the tables of a survey_table go through the same reader and writer in the order of the tables,
+# so every output gets its rows in the same order as without the pipeline; a full queue blocks the threads
+# feeding it, so at most queue_size frames wait in each queue
+def save_tables_pipelined(engine, tasks, chunk_size, readers=1, writers=2, queue_size=4):
+    survey_tables = list(dict.fromkeys(task['survey_table'] for task in tasks))
+    decode_queue = queue.Queue(maxsize=queue_size)
+    write_queues = [queue.Queue(maxsize=queue_size) for writer in range(writers)]
+
+    # a message is (task, chunk, None), (task, None, None) at the end of a table or (task, None, error)
+    def read(reader):
+        pending = [task for task in tasks if survey_tables.index(task['survey_table']) % readers == reader]
+        try:
+            with engine.connect() as connection:
+                while pending:
+                    task = pending.pop(0)
+                    try:
+                        # the table is not read when an earlier table of the unit failed
+                        if task['unit']['status'] != 'failed':
+                            for df in read_task_chunks(connection, task, chunk_size):
+                                if task['failed']:
+                                    break
+                                decode_queue.put((task, df, None))
+                        decode_queue.put((task, None, None))
+                    except Exception as e:
+                        decode_queue.put((task, None, e))
+        except Exception as e:
+            # the connection failed, the tables that were not read fail
+            for task in pending:
+                decode_queue.put((task, None, e))
+        finally:
+            decode_queue.put(None)
+
+    def decode():
+        finished_readers = 0
+        while finished_readers < readers:
+            message = decode_queue.get()
+            if message is None:
+                finished_readers += 1
+                continue
+            task, df, error = message
+            if df is not None:
+                if task['failed']:
+                    continue
+                try:
+                    df = decode_chunk(task, df)
+                except Exception as e:
+                    task['failed'] = True
+                    df, error = None, e
+            write_queues[survey_tables.index(task['survey_table']) % writers].put((task, df, error))
+        for write_queue in write_queues:
+            write_queue.put(None)
+
+    def write(writer):
+        while True:
+            message = write_queues[writer].get()
+            if message is None:
+                return
+            task, df, error = message
+            unit = task['unit']
+            try:
+                if task['state'] == 'closed':
+                    continue
+                if task['state'] == 'pending':
+                    if unit['status'] == 'failed':
+                        # an earlier table of the unit failed
+                        task['failed'] = True
+                        task['state'] = 'closed'
+                        continue
+                    if error is None:
+                        open_outputs(task)
+                if error is not None:
+                    raise error
+                if df is not None:
+                    write_chunk(task, df)
+                else:
+                    close_outputs(task)
+                    unit['status'] = 'done'
+            except Exception as e:
+                logger.error(f"An error occurred while extracting {task['table_name']} for {task['year']}: {e}")
+                if task['state'] == 'open':
+                    abort_outputs(task)
+                task['failed'] = True
+                task['state'] = 'closed'
+                unit['status'] = 'failed'
+
+    threads = ([threading.Thread(target=read, args=(reader,)) for reader in range(readers)]
+               + [threading.Thread(target=decode)]
+               + [threading.Thread(target=write, args=(writer,)) for writer in range(writers)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+# function to read the chunks of the table of a task
+def read_task_chunks(connection, task, chunk_size):
+    return run_report.measure_chunks(task['unit']['stages'], 'access read',
+                                     read_table_chunks(connection, task['query'], task['table_name'], task['table_to_skip'], chunk_size,
+                                                       task['dtypes']))
+
+# function to map the labels of a chunk and build the final dataframe, the completeness counts of the unit are added
+def decode_chunk(task, df):
+    stages = task['unit']['stages']
+    with run_report.measure(stages, 'label decode') as entry:
+        labels = decode_labels(df, task['value_mappings'])
+        logger.debug(f"Mapped the codevalue to valuelabel for {task['table_name']}")
+
+        df = assemble_frame(df, labels, task['year'], task['columns'], task['column_types'])
+        logger.debug(f"Assembled the dataframe with Year and label columns for {task['year']}")
+        entry['rows'] += len(df)
+        entry['columns'] = max(entry['columns'], len(df.columns))
+        entry['memory_mb'] += run_report.frame_mb(df)
+    with run_report.measure(stages, 'counts', df):
+        completeness.add_counts(task['unit'], df)
+    return df
+
+# function to open the outputs of the table of a task
+# the first table of a unit replaces the rows an earlier run wrote for the year
+def open_outputs(task):
+    unit = task['unit']
+    task['replace'] = unit['status'] == 'started'
+    unit['status'] = 'running'
+    # every year is written to its own CSV shard with a header of the columns of the year, the combined CSV is rebuilt
+    # from the shards; the shard is written aside and moved in place once the table is complete, a later table of the unit
+    # starts from a copy of the shard
+    if(task['create_csv']):
+        output_destination = task['output_folder'].replace('<survey-name>', task['survey'])
+        task['csv_path'] = file_operations.get_shard_path(output_destination, task['year'], task['table_name_without_year'] + '.csv')
+        task['csv_temp_path'] = task['csv_path'] + '.tmp'
+        if not task['replace'] and os.path.isfile(task['csv_path']):
+            shutil.copyfile(task['csv_path'], task['csv_temp_path'])
+        else:
+            file_operations.create_shard(task['csv_temp_path'], task['columns'])
+    # a year that is replaced is loaded into a staging table and swapped in when the table is complete
+    if(task['create_postgres_tables']) and task['replace']:
+        postgres_loader.drop_staging(task['survey_table'], task['year'])
+    if(task['create_parquet']):
+        schema = parquet_writer.get_schema(task['parquet_columns'], task['column_types'], task['dtype_plan'])
+        task['partition'] = parquet_writer.open_partition(task['parquet_folder'], task['survey'], task['table_name_without_year'],
+                                                          task['year'], schema, task['replace'])
+    task['state'] = 'open'
+
+# function to write a chunk of the table of a task to its outputs
+def write_chunk(task, df):
+    stages = task['unit']['stages']
+    year = task['year']
+    survey_table = task['survey_table']
+    # Write the df to CSV file
+    if(task['create_csv']):
+        with run_report.measure(stages, 'csv write', df) as entry:
+            size = run_report.file_size(task['csv_temp_path'])
+            df.to_csv(task['csv_temp_path'], index=False, header=False, mode='a', columns=task['columns'])
+            entry['bytes'] += run_report.file_size(task['csv_temp_path']) - size
+        logger.debug(f"Wrote {len(df)} rows to CSV file {task['csv_path']} for {year}")
+    if(task['create_postgres_tables']):
+        # write the df data into postgres table
+        with run_report.measure(stages, 'postgres load', df) as entry:
+            entry['bytes'] += postgres_loader.copy_partition(df, survey_table, year, task['columns'], staging=task['replace'],
+                                                            column_types=task['column_types'])
+        logger.debug(f"Wrote {len(df)} rows to postgres table {survey_table} for {year}")
+    if(task['create_parquet']):
+        with run_report.measure(stages, 'parquet write', df):
+            parquet_writer.write_frame(task['partition'], df)
+        logger.debug(f"Wrote {len(df)} rows to Parquet dataset {survey_table} for {year}")
+
+# function to finish the outputs of the table of a task and record them on its unit
+def close_outputs(task):
+    unit = task['unit']
+    year = task['year']
+    survey_table = task['survey_table']
+    if(task['create_parquet']):
+        with run_report.measure(unit['stages'], 'parquet write') as entry:
+            unit['outputs']['parquet'] = parquet_writer.close_partition(task['partition'])
+            entry['bytes'] += run_report.file_size(task['partition']['path'])
+        logger.info(f"Data written to Parquet dataset {survey_table} for {year}")
+    if(task['create_postgres_tables']):
+        if task['replace']:
+            with run_report.measure(unit['stages'], 'postgres swap'):
+                postgres_loader.swap_partition(survey_table, year)
+        unit['outputs']['postgres'] = survey_table
+        logger.info(f"Data written to postgres table {survey_table} for {year}")
+    if(task['create_csv']):
+        os.replace(task['csv_temp_path'], task['csv_path'])
+        unit['outputs']['csv'] = task['csv_path']
+        logger.info(f"Data written to CSV file {task['table_name_without_year']}.csv for {year}")
+    task['state'] = 'closed'
+
+# function to drop the outputs of a table that failed half way, the outputs of an earlier run are kept
+# an error while cleaning up is only logged, the error of the table is the one reported
+def abort_outputs(task):
+    task['state'] = 'closed'
+    try:
+        if(task['create_csv']) and os.path.isfile(task['csv_temp_path']):
+            os.remove(task['csv_temp_path'])
+        if(task['create_parquet']):
+            parquet_writer.abort_partition(task['partition'])
+        if(task['create_postgres_tables']) and task['replace']:
+            postgres_loader.drop_staging(task['survey_table'], task['year'])
+    except Exception as e:
+        logger.error(f"An error occurred while cleaning up {task['table_name']} for {task['year']}: {e}")
+
+# function to get the query of a table, the table merged into it and the value mappings of its discrete variables
+def get_table_query(meta, year, table_name, tables_to_merge):
+    varnames = metadata_cache.get_varnames(meta, table_name, disc_only=True)
+    logger.debug(f"Got varname from vartable for {table_name}")
+    table_to_skip = None
+    # Create a pandas df for the table along with the column names
+    logger.debug(f"Reading data from {table_name}")
+    if year in tables_to_merge['year'].values and table_name in tables_to_merge['table_to_merge_into'].values:
+        table_to_skip = tables_to_merge.loc[tables_to_merge['table_to_merge_into'] == table_name,
+                                           'table_to_skip'].iloc[0]
+        query = f"SELECT * from {table_name} inner join {table_to_skip} on {table_name}.UNITID = {table_to_skip}.UNITID"
+        varnames.extend(metadata_cache.get_varnames(meta, table_to_skip, disc_only=True))
+    else:
+        query = f"SELECT * FROM {table_name}"
+
+    value_mappings = {}
+    for varname in varnames:
+        if table_to_skip is None:
+            value_mappings[varname] = metadata_cache.get_value_mapping(meta, [table_name], varname)
+        else:
+            value_mappings[varname] = metadata_cache.get_value_mapping(meta, [table_to_skip, table_name], varname)
+    logger.debug(f"Created the dictionaries of codevalue and valuelabel for {table_name}")
+    return query, table_to_skip, value_mappings
+
+# function to read a table as a sequence of dataframes
+# with a chunk_size the rows are fetched chunk_size at a time so memory stays bounded,
+# otherwise the whole table is read at once; the columns of dtypes are converted to their dtype
+def read_table_chunks(connection, query, table_name, table_to_skip=None, chunk_size=0, dtypes={}):
+    if chunk_size:
+        chunks = pd.read_sql(query, connection.execution_options(stream_results=True), chunksize=chunk_size)
+    else:
+        chunks = [pd.read_sql(query, connection)]
+    for df in chunks:
+        logger.debug(f"Created a pandas dataframe for {table_name}")
+        if table_to_skip is not None:
+            # drop table_to_skip.UNITID to UNITID
+            df.rename(columns={table_to_skip + '.UNITID': 'UNITID'}, inplace=True)
+            df.rename(columns={table_name + '.UNITID': 'UNITID'}, inplace=True)
+            # remove duplicate columns, the dtypes are converted in place on a frame of its own
+            df = df.loc[:, ~df.columns.duplicated()].copy()
+        # convert all the df column names to Upper case
+        if not df.columns.str.isupper().all():
+            df.columns = df.columns.str.upper()
+        yield apply_dtypes(df, dtypes)
+
+# function to convert the columns of a dataframe to the dtypes of the dtype plan
+# every chunk of a table gets the same dtypes, so e.g. a code is written as 2 and not as 2.0 in a chunk with missing values;
+# a column whose values do not fit (a code wider than its Fieldwidth) gets the widest integer, or is kept as read
+# the columns are replaced in the dataframe just read, the other columns are not copied
+def apply_dtypes(df, dtypes):
+    for column, dtype in dtypes.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        for candidate in ([dtype, 'Int64'] if dtype.startswith('Int') else [dtype]):
+            try:
+                df[column] = df[column].astype(candidate)
+                break
+            except (TypeError, ValueError) as e:
+                logger.debug(f"Column {column} could not be converted to {candidate}: {e}")
+    return df
+
+# function to decode the codevalues of the discrete variables to their valuelabels in one batch
+# every column is factorized once and only its distinct values are looked up in the valuesets,
+# the labels are returned as categoricals keyed by varname_label
+def decode_labels(df, value_mappings):
+    labels = {}
+    for varname, value_mapping in value_mappings.items():
+        codes, uniques = pd.factorize(df[varname])
+        # the codevalues are strings, so the distinct values are compared as strings
+        unique_labels = pd.Index(uniques.astype(str)).map(value_mapping)
+        label_codes, categories = pd.factorize(unique_labels)
+        # a trailing -1 maps the missing values (code -1) to a missing label
+        label_codes = np.append(label_codes, -1)
+        labels[varname + '_label'] = pd.Categorical.from_codes(label_codes[codes], categories=categories)
+    return labels
+
+# function to build the final dataframe in a single step
+# Year first, then the columns in columnList order with every label right after its varname column,
+# columns missing in the year are left empty and columns not in columnList are kept at the end
+def assemble_frame(df, labels, year, columns, column_types={}):
+    data = {'Year': year}
+    # the empty columns of the chunk, one per data type
+    missing = {}
+    for column in dict.fromkeys(columns):
+        if column in data:
+            continue
+        if column in labels:
+            data[column] = labels[column]
+        elif column in df.columns:
+            data[column] = df[column]
+        else:
+            datatype = column_types.get(column)
+            if datatype not in missing:
+                missing[datatype] = missing_values(len(df), datatype)
+            data[column] = missing[datatype]
+    for column in df.columns:
+        if column not in data:
+            data[column] = df[column]
+            if column + '_label' in labels and column + '_label' not in data:
+                data[column + '_label'] = labels[column + '_label']
+    return pd.DataFrame(data, index=df.index)
+
+# function to get the values of a column the year does not have
+# the values are sparse with nothing but missing values, so they take no memory whatever the number of rows;
+# numeric columns are float like the columns of the years that have them
+def missing_values(length, datatype=None):
+    if datatype == 'N':
+        return pd.arrays.SparseArray(np.full(length, np.nan))
+    return pd.arrays.SparseArray(np.full(length, np.nan, dtype=object), fill_value=np.nan)
+
 def extract_meta_data(db_file, year):
     engine = db.connect_to_database(db_file)
     if engine is None:
-        return
+        return False
     try:
-        postgres_engine = db.connect_to_ipeds_database()
-        #connect to access db and fetch data from tables - vartable, valuesets, tables
-        meta_data = [f'vartable', f'valuesets', f'tables']
-        for table in meta_data:
-            with engine.connect() as connection:
-                query = f"SELECT * FROM {table}{year[-2:]}"
-                df = pd.read_sql(query, connection)
-                df.insert(0, 'Year', year)
-                df.to_sql(table, postgres_engine, if_exists='append', index=False)
-                logger.info(f"Data written to postgres table {table} for {year}")
+        #fetch data from tables - vartable, valuesets, tables through the metadata cache
+        meta = metadata_cache.load_metadata(engine, year)
+        for table, df in meta['frames'].items():
+            df = df.copy()
+            df.insert(0, 'Year', year)
+            # replace the rows of the year written by an earlier run
+            postgres_loader.copy_dataframe(df, table, delete_year=year)
+            logger.info(f"Data written to postgres table {table} for {year}")
+        return True
     except Exception as e:
         logger.error(f"An error occurred: {e}")
+        return False
     finally:
         engine.dispose()
         logger.info(f"Connection closed after extracting meta data for {year}")
\ No newline at end of file
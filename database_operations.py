@@ -2,134 +2,106 @@ import logging
 import os
 import re
 import sqlalchemy as sa
-import helper
-import pandas as pd
+import cip_cache
+import metadata_cache
+import postgres_loader
+import run_report
 
 logger = logging.getLogger(__name__)
 
+# function to connect to an Access file or a snapshot of it
+# every source backend returns a SQLAlchemy engine, so the metadata and table reads are the same for all of them
 def connect_to_database(db_file):
     try:
         logger.info("Connecting to the database using SQLAlchemy")
-        connection_string = (
-            r"DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};"
-            r"DBQ=" + db_file + ";"
-            r"ExtendedAnsiSQL=1;")
-        connection_url = sa.engine.URL.create("access+pyodbc", query={"odbc_connect": connection_string})
-        engine = sa.create_engine(connection_url)
+        backend = SOURCE_BACKENDS[os.path.splitext(db_file)[1].lower()]
+        engine = backend(db_file)
         logger.info("SQLAlchemy engine established")
         return engine
     except Exception as e:
         logger.error("Error while connecting to the database: " + str(e))
         return None
 
+# Access files are read row by row through the Microsoft Access ODBC driver, Windows only
+def _connect_to_access(db_file):
+    connection_string = (
+        r"DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};"
+        r"DBQ=" + db_file + ";"
+        r"ExtendedAnsiSQL=1;")
+    connection_url = sa.engine.URL.create("access+pyodbc", query={"odbc_connect": connection_string})
+    return sa.create_engine(connection_url)
+
+# SQLite snapshots of the Access files (see snapshot.py) and the benchmark fixtures are read in bulk through sqlite
+def _connect_to_sqlite(db_file):
+    return sa.create_engine('sqlite:///' + db_file)
+
+# source backend of every file extension
+SOURCE_BACKENDS = {'.accdb': _connect_to_access, '.mdb': _connect_to_access, '.sqlite': _connect_to_sqlite}
+
+# the postgres engine is pooled and shared by the whole run, see postgres_loader
 def connect_to_ipeds_database():
     try:
         logger.info("Connecting to the IPEDS postgres database")
-        config = helper.read_config()
-        ipeds_db = config['IPEDS DB']['dbname']
-        ipeds_user = config['IPEDS DB']['user']
-        ipeds_password = config['IPEDS DB']['password']
-        ipeds_host = config['IPEDS DB']['host']
-        ipeds_port = config['IPEDS DB']['port']
-        connection_string = f"postgresql://{ipeds_user}:{ipeds_password}@{ipeds_host}:{ipeds_port}/{ipeds_db}"
-        engine = sa.create_engine(connection_string)
+        engine = postgres_loader.get_engine()
         logger.info("IPEDS postgres database connection established")
         return engine
     except Exception as e:
         logger.error("Error while connecting to the IPEDS postgres database: " + str(e))
         return None
 
-def get_table_names(engine, year):
-    try:
-        logger.info(f"Getting table names for {year}")
-        connection = engine.connect()
-        query = f"select Survey, TableName from tables{year[-2:]} where release <> 'NA'"
-        result = connection.execute(sa.text(query))
-        return result.fetchall()
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        return []
-    finally:
-        connection.close()
-
-def get_table_columns(db_file, year, columns={}):
+# function to get the columns of the tables of one Access file
+# returns a list of [survey_table, columns, discrete varnames, data types] in the order of the tables,
+# the lists of all the files are merged by schema_catalog.merge_table_columns
+def get_table_columns(db_file, year):
     engine = connect_to_database(db_file)
     if engine is None:
-        return {}
+        return None
 
     try:
-        survey_table_names = get_table_names(engine, year)
-
-        for survey_table_name in survey_table_names:
+        meta = metadata_cache.load_metadata(engine, year)
+        table_columns = []
+        for survey_table_name in meta['tables']:
             survey = survey_table_name[0].replace(' ', '').split('(')[0]
             table_name = survey_table_name[1]
             table_name_without_year = re.sub('\d{2,}', '', table_name).replace(' ', '').upper()
 
-            with engine.connect() as connection:
-                query = f"select varname from vartable{year[-2:]} where TableName = '{table_name}'"
-                new_columns = connection.execute(sa.text(query)).fetchall()
-                new_columns = [row[0].upper().replace(' ', '') for row in new_columns]
-                new_columns.insert(0, 'Year')
-                new_columns.insert(1, 'UNITID')
-
-                if survey + '_' + table_name_without_year in columns:
-                    seen = set(columns[survey + '_' + table_name_without_year])
-                    list_of_new_columns = [x for x in new_columns if not (x in seen or seen.add(x))]
-                    columns[survey + '_' + table_name_without_year].extend(list_of_new_columns)
-                else:
-                    columns[survey + '_' + table_name_without_year] = new_columns
-                query = f"select varname from vartable{year[-2:]} where TableName = '{table_name}' and format = 'Disc'"
-                categorical_varnames = connection.execute(sa.text(query)).fetchall()
-                categorical_varnames = [row[0].upper().replace(' ', '') for row in categorical_varnames]
-                for varname in categorical_varnames:
-                    varname_index = columns[survey + '_' + table_name_without_year].index(varname)
-                    if varname + '_label' not in columns[survey + '_' + table_name_without_year]:
-                        columns[survey + '_' + table_name_without_year].insert(varname_index + 1, varname + '_label')
+            new_columns = metadata_cache.get_varnames(meta, table_name)
+            new_columns.insert(0, 'Year')
+            new_columns.insert(1, 'UNITID')
+            categorical_varnames = metadata_cache.get_varnames(meta, table_name, disc_only=True)
+            datatypes = metadata_cache.get_datatypes(meta, table_name)
+            widths = metadata_cache.get_widths(meta, table_name)
+            table_columns.append([survey + '_' + table_name_without_year, new_columns, categorical_varnames, datatypes, widths])
 
-        return columns
+        logger.info(f"{meta['queries']} queries sent to the Access database for {year}")
+        return table_columns
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
+        return None
     finally:
         engine.dispose()
         logger.info(f"Connection closed after getting table columns {year}")
 
-def get_counts(columns={}):
+# function to load a CIP workbook into the CIP_<year> table
+# the parsed workbook is cached in cache_folder by its checksum, see cip_cache
+# returns the record of the year for the run report, its status is failed when the workbook could not be loaded
+def create_cips(cips_file_path, year, checksum=None, cache_folder=None):
+    record = {'year': year, 'survey_table': 'CIP_' + year, 'status': 'failed', 'stages': {}}
     engine = connect_to_ipeds_database()
     if engine is None:
-        return {}
-
+        return record
     try:
-        connection = engine.connect()
-        final_df = pd.DataFrame()
-        for survey_table_name in columns.keys():
-            query = f"select c.yr, c.col, c.tc as total_count, c.count_not_nulls from public.get_count( 'public','survey_table_name' ) as c(yr,tc,col,count_not_nulls) order by c.col,c.yr desc"
-            result = connection.execute(sa.text(query.replace('survey_table_name', survey_table_name)))
-            df = pd.DataFrame(result.fetchall(), columns=['year', 'column_name', 'total_count', 'count_not_nulls'])
-            df['survey_table_name'] = survey_table_name
-            logger.info(f"Count data for {survey_table_name} fetched from the IPEDS postgres database")
-            final_df = pd.concat([final_df, df], axis=0)
-            logger.info(f"Count data for {survey_table_name} added to the dataframe")
-        return final_df
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-    finally:
-        engine.dispose()
-        logger.info(f"Connection closed after getting table column counts")
-
-def create_cips(cips_file_path, year):
-    engine = connect_to_ipeds_database()
-    if engine is None:
-        return {}
-    try:
-        connection = engine.connect()
         logger.info(f"reading from excel {year}")
-        df = pd.read_excel(cips_file_path,dtype={'CIPCode':str})
+        with run_report.measure(record['stages'], 'cip import') as entry:
+            df = cip_cache.read_cips(cips_file_path, checksum, cache_folder)
+            entry['rows'] += len(df)
+            entry['columns'] = len(df.columns)
         logger.info(f"writing to sql for {year}")
-        df.to_sql('CIP_'+year, engine, if_exists='replace', index=False)
+        with run_report.measure(record['stages'], 'postgres load', df) as entry:
+            entry['bytes'] += postgres_loader.copy_dataframe(df, 'CIP_'+year, replace=True)
         logger.info(f"CIPS for {year} is written to db")
+        record['status'] = 'done'
     except Exception as e:
         logger.error(f"An error occurred: {e}")
-    finally:
-        engine.dispose()
-        logger.info(f"Connection closed after writing cips data")
\ No newline at end of file
+    return record
@@ -1,36 +1,57 @@
 import csv
 import os
 import re
-import pandas as pd
+import shutil
 import logging
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 
-def create_csv_files(output_folder, columnList = {}, tables_to_merge = pd.DataFrame()):
+# function to create the combined CSV files from the per-year CSV shards
+# the header is the columnList and the shards are appended in the order of years, i.e. the order
+# iterate_folder returns the files; survey_tables limits the rebuild to the survey_tables that changed
+def create_csv_files(output_folder, years, columnList = {}, survey_tables = None):
     for key in columnList:
         survey = key.split('_')[0].split('(')[0]
         table_name_without_year = key.split('_',1)[1]
-        ls = []
-        # create a list of tables to skip creating csv files
-        for x in tables_to_merge['table_to_skip'].values:
-            x = re.sub('\d{2,}', '', x)
-            ls.append(x)
-        
-        if(table_name_without_year in ls):
-            continue
-
-        # Write the df to CSV file
         output_destination = output_folder.replace('<survey-name>', survey)
-        os.makedirs(output_destination, exist_ok=True)
         file_name = table_name_without_year + '.csv'
         csv_path = os.path.join(output_destination, file_name)
-        
+        if survey_tables is not None and key not in survey_tables and os.path.isfile(csv_path):
+            continue
+        shard_paths = [os.path.join(output_destination, 'shards', year, file_name) for year in years]
+        shard_paths = [shard_path for shard_path in shard_paths if os.path.isfile(shard_path)]
+        if not shard_paths:
+            continue
+
+        # write the csv file aside and move it in place once it is complete
+        temp_path = csv_path + '.tmp'
         #create a csv file with the columnList as the header
-        if not os.path.isfile(csv_path):
-            with open(csv_path, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(columnList[key])
-        logger.info(f"Created CSV file {file_name}") 
+        with open(temp_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(columnList[key])
+        for shard_path in shard_paths:
+            append_shard(shard_path, temp_path, columnList[key])
+        os.replace(temp_path, csv_path)
+        logger.info(f"Created CSV file {file_name} from {len(shard_paths)} shards")
+
+# function to create an empty CSV shard with the columns of its year as the header
+def create_shard(shard_path, columns):
+    pd.DataFrame(columns=columns).to_csv(shard_path, index=False)
+
+# function to append the rows of a shard to the combined CSV file in the order of columnList
+# a shard with the columns of columnList is copied as it is, the other shards are read as text in chunks
+# and reindexed to columnList, the columns the year does not have are left empty
+def append_shard(shard_path, csv_path, columns, chunk_size=100000):
+    with open(shard_path, newline='') as shardfile:
+        header = next(csv.reader(shardfile), [])
+    if header == list(columns):
+        with open(shard_path, 'rb') as shardfile, open(csv_path, 'ab') as csvfile:
+            shardfile.readline()
+            shutil.copyfileobj(shardfile, csvfile)
+        return
+    for chunk in pd.read_csv(shard_path, dtype=str, keep_default_na=False, chunksize=chunk_size):
+        chunk.reindex(columns=columns, fill_value='').to_csv(csv_path, mode='a', header=False, index=False)
 
 # function to iterate through the folder and get the access db file path
 # iterate folder such that files are sorted by name 
@@ -40,4 +61,16 @@ def iterate_folder(folderpath, file_extension=".accdb"):
         files.sort(reverse=True)
         for file in files:
             if file.endswith(file_extension):
-                yield os.path.join(root, file)
\ No newline at end of file
+                yield os.path.join(root, file)
+
+# function to get the digits at the end of a file name, e.g. 202122 for C:\AccessDBs\IPEDS202122.accdb
+# os.path is used so the paths of any OS are split the same way
+def get_file_year(file_path):
+    return re.search(r'(\d*)$', os.path.splitext(os.path.basename(file_path))[0]).group(1)
+
+# function to get the path of the per-year CSV shard of a table
+# shards are kept under <output_destination>/shards/<year>/ so a year can be rewritten on its own
+def get_shard_path(output_destination, year, file_name):
+    shard_folder = os.path.join(output_destination, 'shards', year)
+    os.makedirs(shard_folder, exist_ok=True)
+    return os.path.join(shard_folder, file_name)
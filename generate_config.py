@@ -9,7 +9,12 @@ config_file.add_section("Access DBs")
 # ADD SETTINGS TO SECTION
 config_file.set("Access DBs", "FolderPath", r"C:\Users\C00541311\Desktop\AccessDBs")
 config_file.set("Access DBs", "PathToSaveCSV", r"C:\Users\C00541311\Desktop\AccessDBs\CSVs\<survey-name>")
+config_file.set("Access DBs", "PathToSaveParquet", r"C:\Users\C00541311\Desktop\AccessDBs\Parquet\<survey-name>")
 config_file.set("Access DBs", "CIPSFolderPath", r"C:\Users\C00541311\Desktop\AccessDBs\CIP_Codes")
+# odbc reads the Access files through the ODBC driver, snapshot exports them once to SQLite files in SnapshotFolderPath
+# and reads those, which also works on hosts without the driver
+config_file.set("Access DBs", "Source", "odbc")
+config_file.set("Access DBs", "SnapshotFolderPath", r"C:\Users\C00541311\Desktop\AccessDBs\Snapshots")
 # Note: You should replace <survey-name> with the actual survey name or use a placeholder if needed.
 
 # ADD NEW SECTION AND SETTINGS
@@ -29,6 +34,30 @@ config_file.set("IPEDS DB", "password", "qwerty123")
 config_file.add_section("Output")
 config_file.set("Output", "CreateCsv", "True")
 config_file.set("Output", "CreatePostgresTable", "True")
+# Parquet datasets partitioned by Year, needs pyarrow
+config_file.set("Output", "CreateParquet", "False")
+
+# Number of worker processes used to extract the years concurrently, 1 runs serially
+config_file.add_section("Runtime")
+config_file.set("Runtime", "Workers", "1")
+# Number of rows read from an Access table at a time, 0 reads each table at once
+config_file.set("Runtime", "ChunkSize", "0")
+# Record of the processed tables, a new run only redoes the tables that failed or changed
+config_file.set("Runtime", "ManifestPath", "manifest.json")
+# Table columns of every Access file, a file is opened for schema discovery only when it changes
+config_file.set("Runtime", "SchemaCatalogPath", "schema_catalog.json")
+# Parsed CIP workbooks, a workbook that was parsed before is read from here
+config_file.set("Runtime", "CIPCachePath", "cip_cache")
+# Report with the time, rows, bytes and memory of every stage of every table, also written as .csv
+config_file.set("Runtime", "ReportPath", "run_report.json")
+# Number of the slowest tables to keep a cProfile profile of in ProfileFolder, 0 turns profiling off
+config_file.set("Runtime", "ProfileTables", "0")
+config_file.set("Runtime", "ProfileFolder", "profiles")
+# Read, decode and write the tables of a year concurrently, with reader and writer threads on queues of frames
+config_file.set("Runtime", "Pipeline", "False")
+config_file.set("Runtime", "PipelineReaders", "1")
+config_file.set("Runtime", "PipelineWriters", "2")
+config_file.set("Runtime", "PipelineQueueSize", "4")
 
 # SAVE CONFIG FILE
 with open("configurations.ini", 'w') as configfileObj:
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# Synthetic IPEDS-shaped databases for the benchmark, stored as SQLite stand-ins of the Access files.
+# Every year has the tablesYY, vartableYY and valuesetsYY metadata tables and the data tables
+# HD, IC, EF*A, C*_A and GR with discrete and continuous variables, plus the tables that are
+# merged into another table in 2008 and 2010 (see helper.get_tables_to_merge).
+
+# survey, table name (YYYY is replaced by the year), rows per institution, discrete and continuous variables
+# a discrete variable is (varname, data type, number of codes)
+TABLES = [
+    ('Institutional Characteristics', 'HDYYYY', 1,
+     [('STABBR', 'A', 59), ('CONTROL', 'N', 3), ('SECTOR', 'N', 10), ('ICLEVEL', 'N', 3), ('LOCALE', 'N', 12)],
+     ['LATITUDE', 'LONGITUD']),
+    ('Institutional Characteristics', 'ICYYYY', 1,
+     [(f'IC_DISC{i}', 'N', 4) for i in range(20)],
+     [f'IC_CONT{i}' for i in range(10)]),
+    ('Fall Enrollment', 'EFYYYYA', 10,
+     [('EFALEVEL', 'N', 20), ('LINE', 'A', 30), ('SECTION', 'N', 5)],
+     [f'EFCONT{i}' for i in range(20)]),
+    ('Completions', 'CYYYY_A', 15,
+     [('CIPCODE', 'A', 400), ('MAJORNUM', 'N', 2), ('AWLEVEL', 'N', 12)],
+     [f'CTOTAL{i}' for i in range(15)]),
+    ('Graduation Rates', 'GRYYYY', 5,
+     [('GRTYPE', 'N', 40), ('CHRTSTAT', 'N', 15), ('SECTION', 'N', 5)],
+     [f'GRCONT{i}' for i in range(10)]),
+]
+
+# tables of a single year that are merged into another table of that year
+MERGE_TABLES = {
+    '2008': [('Fall Enrollment', 'EF2008D', 1, [], ['RET_PCF', 'STUFACR']),
+             ('Fall Enrollment', 'EF2008F', 1, [('EFRES_DISC', 'N', 3)], ['EFRES01']),
+             ('Institutional Characteristics', 'EF2008DS', 1, [], ['DSCONT1', 'DSCONT2'])],
+    '2010': [('Institutional Characteristics', 'CUSTOMCG2010', 1, [('CGDISC', 'N', 5)], ['CGCONT1'])],
+}
+
+# function to create the SQLite stand-in of the Access database of a year
+# the file name ends with the academic year like the IPEDS files, e.g. IPEDS202122.sqlite
+def create_fixture(folder, year, institutions, seed=0):
+    rng = np.random.default_rng(seed + int(year))
+    db_file = os.path.join(folder, f"IPEDS{year}{(int(year) + 1) % 100:02d}.sqlite")
+    if os.path.isfile(db_file):
+        os.remove(db_file)
+
+    tables = [(survey, table.replace('YYYY', year), rows, disc, cont) for survey, table, rows, disc, cont in TABLES]
+    # a variable that only exists in the year, so the columns of the years differ
+    tables[0] = tables[0][:3] + (tables[0][3] + [(f'C{year[-2:]}BASIC', 'N', 30)],) + tables[0][4:]
+    tables.extend(MERGE_TABLES.get(year, []))
+
+    unitids = np.arange(100000, 100000 + institutions)
+    tables_rows, vartable_rows, valuesets_rows = [], [], []
+    with sqlite3.connect(db_file) as connection:
+        for survey, table_name, rows_per_unitid, disc, cont in tables:
+            tables_rows.append([survey, table_name, 'Final'])
+            data = {'UNITID': np.repeat(unitids, rows_per_unitid)}
+            vartable_rows.append(['UNITID', table_name, 'Cont', 'N', 6])
+            for varname, datatype, codes in disc:
+                vartable_rows.append([varname, table_name, 'Disc', datatype, 2 if datatype == 'N' else 6])
+                code_values = [str(code) if datatype == 'N' else f'{varname[:2]}{code:03d}' for code in range(1, codes + 1)]
+                for code_value in code_values:
+                    valuesets_rows.append([code_value, f'{varname} label {code_value}', table_name, varname])
+                # a few values have no valueset, like the -1/-2 codes of IPEDS
+                values = rng.choice(code_values + ['-2'], size=len(data['UNITID']))
+                data[varname] = values.astype(int) if datatype == 'N' else values
+            for varname in cont:
+                vartable_rows.append([varname, table_name, 'Cont', 'N', 12])
+                values = rng.random(len(data['UNITID'])) * 1000
+                values[rng.random(len(values)) < 0.1] = np.nan
+                data[varname] = values
+            pd.DataFrame(data).to_sql(table_name, connection, index=False)
+
+        # a table that is not released for the year
+        tables_rows.append(['Academic Libraries', f'AL{year}', 'NA'])
+        pd.DataFrame(tables_rows, columns=['Survey', 'TableName', 'Release']).to_sql(f'tables{year[-2:]}', connection, index=False)
+        pd.DataFrame(vartable_rows, columns=['varName', 'TableName', 'format', 'DataType', 'Fieldwidth']).to_sql(
+            f'vartable{year[-2:]}', connection, index=False)
+        pd.DataFrame(valuesets_rows, columns=['Codevalue', 'valueLabel', 'TableName', 'varName']).to_sql(
+            f'valuesets{year[-2:]}', connection, index=False)
+    return db_file
+
+# function to create the fixtures of all the years in a folder
+def create_fixtures(folder, years, institutions, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    return [create_fixture(folder, year, institutions, seed) for year in years]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create synthetic IPEDS-shaped SQLite databases")
+    parser.add_argument('folder')
+    parser.add_argument('--years', default='2008,2010,2020,2021')
+    parser.add_argument('--institutions', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for db_file in create_fixtures(args.folder, args.years.split(','), args.institutions, args.seed):
+        print(f"Fixture {db_file} created")
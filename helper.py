@@ -2,6 +2,7 @@ import configparser
 import logging
 import os
 import sys
+import pandas as pd
 
 # function to read configurations.ini file
 def read_config():
@@ -10,7 +11,8 @@ def read_config():
     return config
 
 # function to create a logger
-def create_logger():
+# worker processes pass file_mode='a' so they do not truncate the log file of the main process
+def create_logger(file_mode='w'):
     config = read_config()
     log_file_path = config['Logger']['LogFilePath']
     log_file_name = config['Logger']['LogFileName']
@@ -18,7 +20,14 @@ def create_logger():
     log_file = log_file_path + log_file_name
     logging.basicConfig(format='%(asctime)s, %(name)s %(levelname)s %(message)s',
                         level=log_level,
-                        handlers=[logging.FileHandler(log_file, mode='w'),
+                        handlers=[logging.FileHandler(log_file, mode=file_mode),
                                   logging.StreamHandler(sys.stdout)])
     return logging
-    
\ No newline at end of file
+    
+
+# function to get the tables that are merged into another table of the same year
+# the rows of table_to_skip are joined on UNITID into table_to_merge_into
+def get_tables_to_merge():
+    #move this to config file
+    data = [['2008','EF2008F','EF2008D'], ['2008','EF2008DS','IC2008'], ['2010','CUSTOMCG2010','HD2010']]
+    return pd.DataFrame(data, columns=['year', 'table_to_skip', 'table_to_merge_into'])
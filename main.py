@@ -1,63 +1,214 @@
 from data_processing import extract_and_save_data, extract_meta_data
-from database_operations import get_counts, get_table_columns, create_cips
-from file_operations import create_csv_files, iterate_folder
+from database_operations import create_cips
+from file_operations import create_csv_files, get_file_year, iterate_folder
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import completeness
 import helper
-import pandas as pd
-from warnings import simplefilter 
-simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
+import manifest
+import parquet_writer
+import schema_catalog
+import snapshot
+import postgres_loader
+import run_report
+import os
+import time
+
+# function to set up logging in the worker processes of the extraction pool
+def init_worker():
+    helper.create_logger(file_mode='a')
+    # each worker opens its own postgres connections
+    postgres_loader.dispose_engine(close=False)
 
 def main():
+    started = time.time()
     config = helper.read_config()
     logging = helper.create_logger()
     logger = logging.getLogger(__name__)
     accessdb_folderpath = config['Access DBs']['folderpath']
     csv_folderpath = config['Access DBs']['PathToSaveCSV']
     cips_file_path = config['Access DBs']['CIPSFolderPath']
+    source = config.get('Access DBs', 'Source', fallback='odbc')
+    snapshot_folderpath = config.get('Access DBs', 'SnapshotFolderPath', fallback=None)
     create_csv = True if config['Output']['CreateCsv'] == 'True' else False
     create_postgres_tables = True if config['Output']['CreatePostgresTable'] == 'True' else False
+    create_parquet = True if config.get('Output', 'CreateParquet', fallback='False') == 'True' else False
+    parquet_folderpath = config.get('Access DBs', 'PathToSaveParquet', fallback=None)
+    workers = config.getint('Runtime', 'Workers', fallback=1)
+    chunk_size = config.getint('Runtime', 'ChunkSize', fallback=0)
+    manifest_path = config.get('Runtime', 'ManifestPath', fallback='manifest.json')
+    catalog_path = config.get('Runtime', 'SchemaCatalogPath', fallback='schema_catalog.json')
+    cip_cache_path = config.get('Runtime', 'CIPCachePath', fallback='cip_cache')
+    report_path = config.get('Runtime', 'ReportPath', fallback='run_report.json')
+    profile_tables = config.getint('Runtime', 'ProfileTables', fallback=0)
+    profile_folder = config.get('Runtime', 'ProfileFolder', fallback='profiles') if profile_tables else None
+    pipeline = None
+    if config.get('Runtime', 'Pipeline', fallback='False') == 'True':
+        pipeline = {'readers': config.getint('Runtime', 'PipelineReaders', fallback=1),
+                    'writers': config.getint('Runtime', 'PipelineWriters', fallback=2),
+                    'queue_size': config.getint('Runtime', 'PipelineQueueSize', fallback=4)}
 
     logger.info("Iterating through the folder: " + accessdb_folderpath)
 
-    #move this to config file
-    data = [['2008','EF2008F','EF2008D'], ['2008','EF2008DS','IC2008'], ['2010','CUSTOMCG2010','HD2010']]
-    tables_to_merge = pd.DataFrame(data, columns=['year', 'table_to_skip', 'table_to_merge_into'])
+    tables_to_merge = helper.get_tables_to_merge()
+
+    run_manifest = manifest.load_manifest(manifest_path)
+    outputs = (['csv'] if create_csv else []) + (['postgres'] if create_postgres_tables else []) + (['parquet'] if create_parquet else [])
 
-    columns = {}
-    for file in iterate_folder(accessdb_folderpath, file_extension=".accdb"):
+    catalog = schema_catalog.load_catalog(catalog_path)
+    table_columns = []
+    # key = year, value = the columns of the survey_tables of that year alone, the units of a year are keyed on them
+    # so a release that adds columns to a survey_table does not redo the earlier years of the survey_table
+    year_columns = {}
+    access_files = []
+    if source == 'snapshot':
+        # the Access files are exported once to snapshots, the run reads the snapshots
+        # an Access file whose snapshot could not be exported is read through the ODBC driver, not from an old snapshot
+        odbc_files = snapshot.update_snapshots(accessdb_folderpath, snapshot_folderpath)
+        for file in odbc_files:
+            logger.warning(f"{file} has no current snapshot, it is read through the ODBC driver")
+        stale_snapshots = [snapshot.get_snapshot_path(snapshot_folderpath, file) for file in odbc_files]
+        source_files = [file for file in iterate_folder(snapshot_folderpath, file_extension=snapshot.SNAPSHOT_EXTENSION)
+                        if file not in stale_snapshots] + odbc_files
+        # in the order iterate_folder gives the files of one folder
+        source_files.sort(key=lambda file: os.path.splitext(os.path.basename(file))[0], reverse=True)
+    else:
+        source_files = list(iterate_folder(accessdb_folderpath, file_extension=".accdb"))
+    for file in source_files:
         logger.info("File found: " + file)
-        year = file.split('\\')[-1].split('.')[0][-6:-2]
-        if create_postgres_tables:
-            extract_meta_data(file, year)      
-        # key = survey name_table name, value = list of columns
-        columns = get_table_columns(file, year, columns)
+        # IPEDS202122.accdb holds 2021
+        year = get_file_year(file)[:4]
+        checksum = manifest.file_checksum(run_manifest, year, file)
+        access_files.append((file, year, checksum))
+        if create_postgres_tables and run_manifest['metadata'].get(year) != checksum:
+            if extract_meta_data(file, year):
+                run_manifest['metadata'][year] = checksum
+                manifest.save_manifest(run_manifest, manifest_path)
+        # unchanged files are read from the schema catalog instead of being opened
+        file_table_columns = schema_catalog.get_table_columns(catalog, file, year)
+        table_columns.extend(file_table_columns)
+        year_columns[year] = schema_catalog.merge_table_columns(file_table_columns)
+    schema_catalog.save_catalog(catalog, catalog_path, [file for file, year, checksum in access_files])
+    # key = survey name_table name, value = list of columns
+    columns = schema_catalog.merge_table_columns(table_columns)
+    # key = survey name_table name, value = vartable data type of every column
+    column_types = schema_catalog.merge_column_types(table_columns)
+    # key = survey name_table name, value = dtype every column is converted to when it is read
+    dtype_plan = schema_catalog.merge_dtype_plan(table_columns)
     logger.info("Dictionary of columns for survey_table created")
 
-    #add columns that are not in the vartable
-    columns['InstitutionalCharacteristics_DRVIC'].append('DVIC13')
-    columns['HumanResources_DRVHR'].append('ACT')
-    columns['InstitutionalCharacteristics_IC_PY'].append('CIPTITLE1')
-    columns['HumanResources_SAL_FACULTY'].append('I')
-    columns['HumanResources_SAL_FACULTY'].append('DROP')
+    #add columns that are not in the vartable, to the columnList and to the years with the survey_table
+    extra_columns = [('InstitutionalCharacteristics_DRVIC', 'DVIC13'), ('HumanResources_DRVHR', 'ACT'),
+                     ('InstitutionalCharacteristics_IC_PY', 'CIPTITLE1'), ('HumanResources_SAL_FACULTY', 'I'),
+                     ('HumanResources_SAL_FACULTY', 'DROP')]
+    for survey_table, column in extra_columns:
+        columns[survey_table].append(column)
+        for columnList in year_columns.values():
+            if survey_table in columnList:
+                columnList[survey_table].append(column)
+
+    # only the years with units that failed or changed since the last run are extracted
+    jobs = []
+    for file, year, checksum in access_files:
+        if manifest.is_year_done(run_manifest, year, checksum, year_columns[year], outputs):
+            logger.info(f"Skipping {file}, all tables already processed")
+            continue
+        manifest_units = {key: unit for key, unit in run_manifest['units'].items() if key.startswith(year + '/')}
+        jobs.append((file, year, checksum, manifest_units))
+
+    changed_survey_tables = set()
+    # units of this run and the stages of the main process for the run report
+    run_units = []
+    records = []
+    def record_units(file, year, checksum, units):
+        manifest.record_year(run_manifest, year, file, checksum, units)
+        manifest.save_manifest(run_manifest, manifest_path)
+        run_units.extend(units or [])
+        # the shards of a failed unit are those of the earlier run, its combined CSV is not rebuilt for it
+        changed_survey_tables.update(unit['survey_table'] for unit in units or [] if unit['status'] not in ('skipped', 'failed'))
+
+    # the arguments of extract_and_save_data that are the same for every year
+    extract_options = dict(columnList = columns, chunk_size = chunk_size, create_parquet = create_parquet,
+                           parquet_folder = parquet_folderpath, columnTypes = column_types, profile_folder = profile_folder,
+                           pipeline = pipeline, dtypePlan = dtype_plan)
+    def extract_arguments(file, year, checksum, manifest_units):
+        return ((file, year, create_csv, create_postgres_tables, csv_folderpath, tables_to_merge),
+                dict(extract_options, yearColumns = year_columns[year], checksum = checksum, manifest_units = manifest_units))
+
+    if workers > 1:
+        # extract the years concurrently, each worker writes its own per-year CSV shards
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = {}
+            for file, year, checksum, manifest_units in jobs:
+                args, kwargs = extract_arguments(file, year, checksum, manifest_units)
+                futures[executor.submit(extract_and_save_data, *args, **kwargs)] = (file, year, checksum)
+            for future in as_completed(futures):
+                record_units(*futures[future], future.result())
+    else:
+        for file, year, checksum, manifest_units in jobs:
+            args, kwargs = extract_arguments(file, year, checksum, manifest_units)
+            record_units(file, year, checksum, extract_and_save_data(*args, **kwargs))
+    logger.info("Data extracted and saved")  
 
-    #create csv files with the column names
+    #create the csv files with the column names from the per-year shards, in the order of the files
     if(create_csv):
-        create_csv_files(csv_folderpath, columns, tables_to_merge)
+        record = {'year': '', 'survey_table': 'CSV files', 'status': 'done', 'stages': {}}
+        with run_report.measure(record['stages'], 'csv write'):
+            create_csv_files(csv_folderpath, [year for file, year, checksum in access_files], columns, changed_survey_tables)
+        records.append(record)
         logger.info("All CSV files created")
 
-    for file in iterate_folder(accessdb_folderpath, file_extension=".accdb"):
-        logger.info("File found: " + file)
-        year = file.split('\\')[-1].split('.')[0][-6:-2]
-        extract_and_save_data(file, year, create_csv, create_postgres_tables, csv_folderpath, tables_to_merge, columnList = columns)
-    logger.info("Data extracted and saved")  
+    # the Parquet partitions written before a survey_table gained columns (or with older column types) are rewritten
+    # to the schema of all the years, every dataset is checked since only the footers of the part files are read
+    if(create_parquet):
+        record = {'year': '', 'survey_table': 'Parquet files', 'status': 'done', 'stages': {}}
+        with run_report.measure(record['stages'], 'parquet write'):
+            parquet_writer.unify_datasets(parquet_folderpath, columns, column_types, dtype_plan)
+        records.append(record)
+        logger.info("All Parquet datasets share the schema of all the years")
 
+    # only the CIP workbooks that changed since they were loaded are parsed and loaded, in parallel like the years
+    cip_jobs = []
     for file in iterate_folder(cips_file_path, file_extension=".xlsx"):
         logger.info("File found: " + file)
-        year = file.split('\\')[-1].split('.')[0][-4:]
-        create_cips(file, year)
+        year = get_file_year(file)[-4:]
+        checksum = manifest.file_checksum(run_manifest, year, file, section='cips')
+        if manifest.is_cips_done(run_manifest, year, checksum):
+            logger.info(f"Skipping {file}, CIPs already loaded")
+            continue
+        cip_jobs.append((file, year, checksum))
+
+    def record_cips(file, year, checksum, record):
+        records.append(record)
+        if record['status'] == 'done':
+            manifest.record_cips(run_manifest, year, file, checksum)
+            manifest.save_manifest(run_manifest, manifest_path)
+
+    if workers > 1 and len(cip_jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = {executor.submit(create_cips, file, year, checksum, cip_cache_path): (file, year, checksum)
+                       for file, year, checksum in cip_jobs}
+            for future in as_completed(futures):
+                record_cips(*futures[future], future.result())
+    else:
+        for file, year, checksum in cip_jobs:
+            record_cips(file, year, checksum, create_cips(file, year, checksum, cip_cache_path))
     logger.info("CIPS Data extracted and saved")
     
-    counts = get_counts(columns)
-    counts.to_csv('counts.csv', index=False)
+    # completeness counts gathered during the extraction, for the years in the folder
+    years = [year for file, year, checksum in access_files]
+    record = {'year': '', 'survey_table': 'counts.csv', 'status': 'done', 'stages': {}}
+    with run_report.measure(record['stages'], 'counts') as entry:
+        counts = completeness.get_counts([unit for unit in run_manifest['units'].values() if unit['year'] in years], columns)
+        counts.to_csv('counts.csv', index=False)
+        entry['rows'] += len(counts)
+        entry['bytes'] += run_report.file_size('counts.csv')
+    records.append(record)
     logger.info("Counts saved to CSV file")
+
+    # time, rows, bytes and memory of every stage of every table, and the profiles of the slowest tables
+    profiles = run_report.prune_profiles(profile_folder, [unit for unit in run_units if unit['status'] != 'skipped'],
+                                         profile_tables) if profile_folder else []
+    run_report.save_report(report_path, run_units, records, started, profiles)
+    postgres_loader.dispose_engine()
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# the run manifest records every completed (year, survey_table) unit of the Access files
+# {'files': {year: {path, size, mtime, checksum, units}}, 'units': {unit_key: unit}, 'metadata': {year: checksum},
+#  'cips': {year: {path, size, mtime, checksum}}}
+# a unit is done when it was written from a file with the same checksum, with the same columns of its year
+# and to all the outputs requested now, so a new run only redoes the failed or changed units; the columns
+# other years add to a survey_table do not change the units of a year
+
+# function to read the manifest, an empty manifest is returned on the first run
+def load_manifest(manifest_path):
+    if not os.path.isfile(manifest_path):
+        return {'files': {}, 'units': {}, 'metadata': {}, 'cips': {}}
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    logger.info(f"Manifest read with {len(manifest['units'])} processed units")
+    return manifest
+
+# function to write the manifest, through a temporary file so a crash never leaves it half written
+def save_manifest(manifest, manifest_path):
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(temp_path, manifest_path)
+
+# function to get the sha256 checksum of a file
+# the checksum of the previous run is reused while the size and mtime of the file are unchanged
+# section is 'files' for the Access files and 'cips' for the CIP workbooks
+def file_checksum(manifest, year, file_path, section='files'):
+    stat = os.stat(file_path)
+    record = manifest.get(section, {}).get(year)
+    if record and record['path'] == file_path and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime:
+        return record['checksum']
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# function to get the hash of the columns of a survey_table in a year, the outputs are redone when they change
+def columns_hash(columns):
+    return hashlib.sha1(json.dumps(columns).encode()).hexdigest()
+
+def unit_key(year, survey_table):
+    return f"{year}/{survey_table}"
+
+# function to check if a unit was already written from the same file and columns to the requested outputs
+def is_unit_done(manifest_units, key, checksum, columns, outputs):
+    unit = manifest_units.get(key)
+    if unit is None or unit['checksum'] != checksum or unit['columns'] != columns_hash(columns):
+        return False
+    # the completeness counts of the unit are needed for counts.csv
+    if 'counts' not in unit:
+        return False
+    for output in outputs:
+        if output not in unit['outputs']:
+            return False
+        # the CSV shard must still be there to rebuild the combined CSV, and the Parquet partition to be read
+        if output in ('csv', 'parquet') and not os.path.exists(unit['outputs'][output]):
+            return False
+    return True
+
+# function to check if every unit of a year is done, so its Access file does not need to be opened at all
+# columnList has the columns of the survey_tables of the year
+def is_year_done(manifest, year, checksum, columnList, outputs):
+    record = manifest['files'].get(year)
+    if record is None or record['checksum'] != checksum:
+        return False
+    for key in record['units']:
+        unit = manifest['units'].get(key)
+        if unit is None or unit['survey_table'] not in columnList:
+            return False
+        if not is_unit_done(manifest['units'], key, checksum, columnList[unit['survey_table']], outputs):
+            return False
+    return True
+
+# function to record the units a worker returned for a year, units is None when the file could not be read
+# failed units are removed so the next run redoes them, the file is recorded once all units are done
+def record_year(manifest, year, file_path, checksum, units):
+    failed = units is None
+    for unit in units or []:
+        key = unit_key(year, unit['survey_table'])
+        if unit['status'] == 'done':
+            manifest['units'][key] = unit
+        elif unit['status'] == 'failed':
+            manifest['units'].pop(key, None)
+            failed = True
+    if failed:
+        manifest['files'].pop(year, None)
+        return
+    stat = os.stat(file_path)
+    manifest['files'][year] = {'path': file_path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                               'checksum': checksum, 'units': [unit_key(year, unit['survey_table']) for unit in units]}
+
+# function to check if the CIP workbook of a year was loaded with the same checksum
+def is_cips_done(manifest, year, checksum):
+    record = manifest.get('cips', {}).get(year)
+    return record is not None and record['checksum'] == checksum
+
+# function to record the CIP workbook of a year once it is loaded
+def record_cips(manifest, year, file_path, checksum):
+    stat = os.stat(file_path)
+    manifest.setdefault('cips', {})[year] = {'path': file_path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'checksum': checksum}
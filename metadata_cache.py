@@ -0,0 +1,75 @@
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# function to load the vartable, valuesets and tables of a year once and index them
+# key = upper case table name (and varname), so the extraction and schema discovery
+# look the metadata up in memory instead of sending one query per table and varname
+def load_metadata(engine, year):
+    meta = {'year': year, 'frames': {}, 'queries': 0}
+    with engine.connect() as connection:
+        for table in ['vartable', 'valuesets', 'tables']:
+            query = f"SELECT * FROM {table}{year[-2:]}"
+            meta['frames'][table] = pd.read_sql(query, connection)
+            meta['queries'] += 1
+    logger.info(f"Metadata for {year} loaded with {meta['queries']} queries")
+
+    # tables with data released for the year
+    tables = _lower_columns(meta['frames']['tables'])
+    tables = tables[tables['release'].notna() & (tables['release'] != 'NA')]
+    meta['tables'] = list(zip(tables['survey'], tables['tablename']))
+
+    # varnames of every table in the order of the vartable, and the discrete ones among them
+    vartable = _lower_columns(meta['frames']['vartable'])
+    vartable = vartable.assign(tablename=vartable['tablename'].str.upper(),
+                               varname=vartable['varname'].str.upper().str.replace(' ', ''))
+    meta['varnames'] = {}
+    meta['disc_varnames'] = {}
+    meta['datatypes'] = {}
+    meta['widths'] = {}
+    for table_name, group in vartable.groupby('tablename', sort=False):
+        meta['varnames'][table_name] = group['varname'].tolist()
+        meta['disc_varnames'][table_name] = group.loc[group['format'] == 'Disc', 'varname'].tolist()
+        # DataType is 'N' for numeric and 'A' for alphanumeric variables
+        if 'datatype' in group.columns:
+            meta['datatypes'][table_name] = dict(zip(group['varname'], group['datatype']))
+        # Fieldwidth is the number of characters (digits) of the values
+        if 'fieldwidth' in group.columns:
+            widths = pd.to_numeric(group['fieldwidth'], errors='coerce')
+            meta['widths'][table_name] = {varname: int(width) for varname, width in zip(group['varname'], widths) if pd.notna(width)}
+
+    # codevalue to valuelabel mapping of every discrete variable
+    valuesets = _lower_columns(meta['frames']['valuesets'])
+    valuesets = valuesets.assign(tablename=valuesets['tablename'].str.upper(),
+                                 varname=valuesets['varname'].str.upper().str.replace(' ', ''))
+    meta['valuesets'] = {}
+    for key, group in valuesets.groupby(['tablename', 'varname'], sort=False):
+        meta['valuesets'][key] = dict(zip(group['codevalue'], group['valuelabel']))
+    logger.debug(f"Indexed metadata of {len(meta['varnames'])} tables for {year}")
+    return meta
+
+# function to get the varnames of a table, only the discrete ones if disc_only is set
+def get_varnames(meta, table_name, disc_only=False):
+    index = meta['disc_varnames'] if disc_only else meta['varnames']
+    return list(index.get(table_name.upper(), []))
+
+# function to get the data type of every varname of a table
+def get_datatypes(meta, table_name):
+    return dict(meta['datatypes'].get(table_name.upper(), {}))
+
+# function to get the field width of every varname of a table
+def get_widths(meta, table_name):
+    return dict(meta['widths'].get(table_name.upper(), {}))
+
+# function to get the codevalue to valuelabel mapping of a varname
+# a merged table looks the varname up in all of its tables
+def get_value_mapping(meta, table_names, varname):
+    value_mapping = {}
+    for table_name in table_names:
+        value_mapping.update(meta['valuesets'].get((table_name.upper(), varname), {}))
+    return value_mapping
+
+# the column names differ in case between the years, e.g. varName and varname
+def _lower_columns(df):
+    return df.rename(columns=str.lower)
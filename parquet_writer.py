@@ -0,0 +1,155 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# arrow types of the nullable integer dtypes of the dtype plan
+# a code wider than its Fieldwidth is read as Int64 (see data_processing.apply_dtypes), so the codes are stored at least
+# as int32, which has the physical type of int8 and int16 in the Parquet file and holds every code of up to 9 digits
+_INTEGER_TYPES = {'Int8': pa.int32(), 'Int16': pa.int32(), 'Int32': pa.int32(), 'Int64': pa.int64()} if pa is not None else {}
+
+# every survey_table is written as a Parquet dataset partitioned by Year:
+# <parquet folder of the survey>/<table>/Year=<year>/part-0.parquet
+# all the years share one schema built from the columnList and the vartable data types,
+# so readers can select columns and years without scanning the other partitions
+
+# function to build the arrow schema of a survey_table from its dtype plan (see schema_catalog.merge_dtype_plan)
+# the discrete numeric codes are integers (int32, int64 for the widest codes), the discrete 'A' codes and the label columns are
+# dictionary encoded strings, the continuous DataType 'N' columns are float64 (they hold missing values),
+# and the other 'A' columns and the columns without a known data type are strings
+def get_schema(columns, column_types={}, dtypes={}):
+    if pa is None:
+        raise ImportError("pyarrow is required to create Parquet files, install it with pip install pyarrow")
+    fields = []
+    for column in dict.fromkeys(columns):
+        if column == 'Year':
+            # Year is the partition key and is stored in the path of the partition
+            continue
+        if dtypes.get(column) in _INTEGER_TYPES:
+            fields.append(pa.field(column, _INTEGER_TYPES[dtypes[column]]))
+        elif column == 'UNITID':
+            fields.append(pa.field(column, pa.int64()))
+        elif column.endswith('_label') or dtypes.get(column) == 'category':
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        elif column_types.get(column) == 'N':
+            fields.append(pa.field(column, pa.float64()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+# function to open the partition of a year, the rows of an earlier run are replaced when it is closed
+# with replace=False (a second table of the same survey_table in a year) the rows go to the next part file
+def open_partition(parquet_folder, survey, table_name_without_year, year, schema, replace=True):
+    partition_folder = os.path.join(parquet_folder.replace('<survey-name>', survey), table_name_without_year, 'Year=' + year)
+    os.makedirs(partition_folder, exist_ok=True)
+    part = 0 if replace else len(_part_files(partition_folder))
+    path = os.path.join(partition_folder, f'part-{part}.parquet')
+    temp_path = path + '.tmp'
+    return {'folder': partition_folder, 'path': path, 'temp_path': temp_path, 'schema': schema, 'replace': replace,
+            'writer': pq.ParquetWriter(temp_path, schema, compression='snappy')}
+
+# function to append a dataframe (or a chunk of it) to the partition
+def write_frame(partition, df):
+    arrays = [_to_arrow(df[field.name], field.type) if field.name in df.columns
+              else pa.nulls(len(df), field.type) for field in partition['schema']]
+    partition['writer'].write_table(pa.Table.from_arrays(arrays, schema=partition['schema']))
+
+# function to finish the partition and move it in place of the partition of an earlier run
+def close_partition(partition):
+    partition['writer'].close()
+    os.replace(partition['temp_path'], partition['path'])
+    if partition['replace']:
+        for file_name in _part_files(partition['folder']):
+            if os.path.join(partition['folder'], file_name) != partition['path']:
+                os.remove(os.path.join(partition['folder'], file_name))
+    logger.debug(f"Parquet partition {partition['path']} written")
+    return partition['folder']
+
+# function to drop a partition that failed half way
+def abort_partition(partition):
+    partition['writer'].close()
+    if os.path.isfile(partition['temp_path']):
+        os.remove(partition['temp_path'])
+
+# function to rewrite the partitions of the datasets that do not have the schema of all the years
+# a partition written before a later release added columns to its survey_table gets the new columns empty,
+# only its part files are rewritten, the Access file of the year is not read again;
+# survey_tables limits the check to the survey_tables that changed
+def unify_datasets(parquet_folder, columnList, columnTypes={}, dtypePlan={}, survey_tables=None):
+    for key in columnList:
+        if survey_tables is not None and key not in survey_tables:
+            continue
+        survey = key.split('_')[0].split('(')[0]
+        table_name_without_year = key.split('_',1)[1]
+        dataset_folder = os.path.join(parquet_folder.replace('<survey-name>', survey), table_name_without_year)
+        if not os.path.isdir(dataset_folder):
+            continue
+        try:
+            schema = get_schema(columnList[key], columnTypes.get(key, {}), dtypePlan.get(key, {}))
+            rewritten = 0
+            for partition_name in os.listdir(dataset_folder):
+                partition_folder = os.path.join(dataset_folder, partition_name)
+                if not os.path.isdir(partition_folder):
+                    continue
+                for file_name in _part_files(partition_folder):
+                    path = os.path.join(partition_folder, file_name)
+                    if not pq.read_schema(path).equals(schema, check_metadata=False):
+                        _rewrite_part(path, schema)
+                        rewritten += 1
+            if rewritten:
+                logger.info(f"Rewrote {rewritten} Parquet partitions of {key} to the schema of all the years")
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+
+# function to rewrite a part file to a schema, through a temporary file so a failure leaves the part file as it was
+def _rewrite_part(path, schema):
+    table = pq.read_table(path)
+    arrays = [table.column(field.name).cast(field.type) if field.name in table.column_names
+              else pa.nulls(table.num_rows, field.type) for field in schema]
+    temp_path = path + '.tmp'
+    pq.write_table(pa.Table.from_arrays(arrays, schema=schema), temp_path, compression='snappy')
+    os.replace(temp_path, path)
+
+def _part_files(partition_folder):
+    return [file_name for file_name in os.listdir(partition_folder)
+            if file_name.startswith('part-') and file_name.endswith('.parquet')]
+
+def _to_arrow(series, arrow_type):
+    if isinstance(series.dtype, pd.SparseDtype):
+        # a column the year does not have
+        return pa.nulls(len(series), arrow_type)
+    if pa.types.is_dictionary(arrow_type):
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category')
+        codes = series.cat.codes.to_numpy().astype(np.int32)
+        indices = pa.array(codes, mask=codes < 0)
+        dictionary = pa.array(series.cat.categories.astype(str), type=pa.string())
+        return pa.DictionaryArray.from_arrays(indices, dictionary)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    try:
+        return pa.array(series, type=arrow_type, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # the column holds values of another type in this year, e.g. text in a numeric column
+        if pa.types.is_string(arrow_type):
+            return pa.array(series.where(series.isna(), series.astype(str)), type=arrow_type, from_pandas=True)
+        values = pd.to_numeric(series, errors='coerce')
+        if pa.types.is_integer(arrow_type):
+            limits = np.iinfo(arrow_type.to_pandas_dtype())
+            values = values.where((values == values.round()) & values.between(limits.min, limits.max))
+        # a value that does not fit the schema fails the table, so the outputs never disagree
+        lost = int(series.notna().sum() - values.notna().sum())
+        if lost:
+            raise ValueError(f"{lost} values of column {series.name} do not fit the Parquet type {arrow_type}")
+        if pa.types.is_integer(arrow_type):
+            values = values.astype('Int64')
+        return pa.array(values, type=arrow_type, from_pandas=True)
@@ -0,0 +1,269 @@
+import io
+import logging
+import pandas as pd
+import sqlalchemy as sa
+import helper
+
+logger = logging.getLogger(__name__)
+
+# one pooled engine per process, shared by every load of the run
+_engine = None
+
+# number of rows sent to postgres in one COPY
+COPY_BATCH_ROWS = 50000
+
+# function to get the pooled engine of the IPEDS postgres database
+def get_engine():
+    global _engine
+    if _engine is None:
+        config = helper.read_config()
+        ipeds_db = config['IPEDS DB']['dbname']
+        ipeds_user = config['IPEDS DB']['user']
+        ipeds_password = config['IPEDS DB']['password']
+        ipeds_host = config['IPEDS DB']['host']
+        ipeds_port = config['IPEDS DB']['port']
+        connection_string = f"postgresql://{ipeds_user}:{ipeds_password}@{ipeds_host}:{ipeds_port}/{ipeds_db}"
+        _engine = sa.create_engine(connection_string, pool_pre_ping=True)
+        logger.info("IPEDS postgres engine created")
+    return _engine
+
+# function to release the pooled connections at the end of the run
+# worker processes pass close=False so they do not close the connections inherited from the parent
+def dispose_engine(close=True):
+    global _engine
+    if _engine is not None:
+        _engine.dispose(close=close)
+        _engine = None
+
+# function to bulk load a dataframe into a postgres table through COPY ... FROM STDIN
+# the table is created with the columns in the given order (e.g. from columnList) if it does not exist,
+# replace drops the table first like to_sql(if_exists='replace'), the drop, create and COPY are one transaction
+# so a failed COPY leaves the previous table and readers never see it empty
+# delete_year removes the rows of that year in the same transaction, so a year is replaced atomically
+# column_types gives the vartable DataType of the columns, see _column_type
+# returns the number of bytes sent to postgres
+def copy_dataframe(df, table_name, columns=None, replace=False, delete_year=None, column_types=None):
+    columns = list(dict.fromkeys(columns if columns is not None else df.columns))
+    # columns of the df that are not in columns are kept at the end, like the frame itself
+    columns.extend(column for column in df.columns if column not in columns)
+
+    if replace:
+        with get_engine().begin() as connection:
+            connection.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"), {'table_name': table_name})
+            connection.execute(sa.text(f"DROP TABLE IF EXISTS {_quote(table_name)}"))
+            table_types = _create_table(connection, table_name, columns, df, column_types)
+            copied_bytes = _copy(connection, table_name, df, table_types)
+        logger.debug(f"Copied {len(df)} rows into postgres table {table_name}")
+        return copied_bytes
+
+    with get_engine().begin() as connection:
+        # serialize the create/alter of the same table from concurrent workers
+        connection.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"), {'table_name': table_name})
+        table_types = _create_table(connection, table_name, columns, df, column_types)
+
+    with get_engine().begin() as connection:
+        if delete_year is not None:
+            result = connection.execute(sa.text(f"DELETE FROM {_quote(table_name)} WHERE \"Year\" = :year"), {'year': delete_year})
+            if result.rowcount:
+                logger.info(f"Deleted {result.rowcount} rows of {delete_year} from postgres table {table_name}")
+        copied_bytes = _copy(connection, table_name, df, table_types)
+    logger.debug(f"Copied {len(df)} rows into postgres table {table_name}")
+    return copied_bytes
+
+# function to COPY the rows of a dataframe into a table, returns the number of bytes sent
+# the rows are turned into CSV text and sent COPY_BATCH_ROWS at a time, so a large table read at once (ChunkSize 0)
+# is never held a second time as a copy of the frame or as the whole of its text
+def _copy(connection, table_name, df, table_types):
+    query = (f"COPY {_quote(table_name)} ({', '.join(_quote(column) for column in df.columns)}) "
+             f"FROM STDIN WITH (FORMAT csv)")
+    copied_bytes = 0
+    cursor = connection.connection.cursor()
+    try:
+        for start in range(0, len(df), COPY_BATCH_ROWS):
+            buffer = io.StringIO()
+            _copy_frame(df.iloc[start:start + COPY_BATCH_ROWS], table_types).to_csv(buffer, index=False, header=False)
+            copied_bytes += buffer.tell()
+            buffer.seek(0)
+            cursor.copy_expert(query, buffer)
+    finally:
+        cursor.close()
+    return copied_bytes
+
+# the survey_table tables are partitioned by Year, <table> holds one partition <table>_<year> per year
+# a year that is replaced is copied into the staging table <table>_<year>_stage, indexed on UNITID and swapped
+# in place of the partition of the year in one transaction, so the other years and the readers are never
+# left without the rows of the year; later tables of the same year are copied into the partition itself
+
+# function to bulk load a dataframe into the partition of a year, or into its staging table with staging=True
+# the partitioned table and the partition (or staging table) are created if they do not exist,
+# with the column types of the vartable DataType in column_types
+# returns the number of bytes sent to postgres
+def copy_partition(df, table_name, year, columns=None, staging=False, column_types=None):
+    columns = list(dict.fromkeys(columns if columns is not None else df.columns))
+    columns.extend(column for column in df.columns if column not in columns)
+    target = _staging_name(table_name, year) if staging else _partition_name(table_name, year)
+
+    with get_engine().begin() as connection:
+        connection.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"), {'table_name': table_name})
+        table_types = _create_partitioned_table(connection, table_name, columns, df, column_types)
+        if staging:
+            connection.execute(sa.text(f"CREATE TABLE IF NOT EXISTS {_quote(target)} (LIKE {_quote(table_name)} INCLUDING DEFAULTS)"))
+            # columns added to the partitioned table since the staging table was created
+            _add_missing_columns(connection, table_name, target)
+        else:
+            connection.execute(sa.text(f"CREATE TABLE IF NOT EXISTS {_quote(target)} PARTITION OF {_quote(table_name)} "
+                                       f"FOR VALUES IN ({_literal(year)})"))
+
+    with get_engine().begin() as connection:
+        copied_bytes = _copy(connection, target, df, table_types)
+    logger.debug(f"Copied {len(df)} rows into postgres table {target}")
+    return copied_bytes
+
+# function to swap the staging table of a year in place of the partition of the year
+# the staging table gets the UNITID index and a check on Year before it is attached, so attaching it needs no scan,
+# and the statistics of the partition and the partitioned table are refreshed after the swap
+# a year without a staging table (no rows were copied) is left without a partition
+def swap_partition(table_name, year):
+    staging = _staging_name(table_name, year)
+    partition = _partition_name(table_name, year)
+    with get_engine().begin() as connection:
+        connection.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"), {'table_name': table_name})
+        if _relkind(connection, table_name) != 'p':
+            return
+        if _relkind(connection, staging) is not None:
+            _add_missing_columns(connection, table_name, staging)
+            if 'UNITID' in _table_types(connection, staging):
+                connection.execute(sa.text(f"CREATE INDEX ON {_quote(staging)} (\"UNITID\")"))
+            check = _quote(staging + '_year')
+            connection.execute(sa.text(f"ALTER TABLE {_quote(staging)} ADD CONSTRAINT {check} "
+                                       f"CHECK (\"Year\" IS NOT NULL AND \"Year\" = {_literal(year)})"))
+        if _relkind(connection, partition) is not None:
+            connection.execute(sa.text(f"ALTER TABLE {_quote(table_name)} DETACH PARTITION {_quote(partition)}"))
+            connection.execute(sa.text(f"DROP TABLE {_quote(partition)}"))
+        if _relkind(connection, staging) is None:
+            logger.info(f"No rows of {year} for postgres table {table_name}")
+            return
+        connection.execute(sa.text(f"ALTER TABLE {_quote(staging)} RENAME TO {_quote(partition)}"))
+        connection.execute(sa.text(f"ALTER TABLE {_quote(table_name)} ATTACH PARTITION {_quote(partition)} "
+                                   f"FOR VALUES IN ({_literal(year)})"))
+        connection.execute(sa.text(f"ALTER TABLE {_quote(partition)} DROP CONSTRAINT {check}"))
+    logger.info(f"Swapped the partition of {year} into postgres table {table_name}")
+    with get_engine().begin() as connection:
+        # ANALYZE of the partitioned table reads every partition, so it waits for the swaps of the other years
+        connection.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"), {'table_name': table_name})
+        connection.execute(sa.text(f"ANALYZE {_quote(partition)}"))
+        connection.execute(sa.text(f"ANALYZE {_quote(table_name)}"))
+
+# function to drop the staging table of a year, left by a load that failed half way
+def drop_staging(table_name, year):
+    with get_engine().begin() as connection:
+        connection.execute(sa.text(f"DROP TABLE IF EXISTS {_quote(_staging_name(table_name, year))}"))
+
+# function to create the partitioned table, or add the columns it is missing, and return its column types
+# a table of an earlier run that is not partitioned is converted once, with one partition per year it holds
+def _create_partitioned_table(connection, table_name, columns, df, column_types=None):
+    relkind = _relkind(connection, table_name)
+    if relkind == 'r':
+        flat_table = table_name + '_flat'
+        connection.execute(sa.text(f"ALTER TABLE {_quote(table_name)} RENAME TO {_quote(flat_table)}"))
+        connection.execute(sa.text(f"CREATE TABLE {_quote(table_name)} (LIKE {_quote(flat_table)} INCLUDING DEFAULTS) "
+                                   f"PARTITION BY LIST (\"Year\")"))
+        years = connection.execute(sa.text(f"SELECT DISTINCT \"Year\" FROM {_quote(flat_table)} WHERE \"Year\" IS NOT NULL")).scalars()
+        for year in years:
+            connection.execute(sa.text(f"CREATE TABLE {_quote(_partition_name(table_name, str(year)))} PARTITION OF "
+                                       f"{_quote(table_name)} FOR VALUES IN ({_literal(year)})"))
+        connection.execute(sa.text(f"INSERT INTO {_quote(table_name)} SELECT * FROM {_quote(flat_table)} WHERE \"Year\" IS NOT NULL"))
+        connection.execute(sa.text(f"DROP TABLE {_quote(flat_table)}"))
+        logger.info(f"Converted postgres table {table_name} to a table partitioned by Year")
+    elif relkind is None:
+        table_types = {column: _column_type(column, df, column_types) for column in columns}
+        definition = ', '.join(f"{_quote(column)} {sql_type}" for column, sql_type in table_types.items())
+        connection.execute(sa.text(f"CREATE TABLE {_quote(table_name)} ({definition}) PARTITION BY LIST (\"Year\")"))
+        logger.info(f"Created postgres table {table_name} partitioned by Year")
+    table_types = _create_table(connection, table_name, columns, df, column_types)
+    # the index of the partitioned table is created once, the partitions attached later get it as well
+    if relkind != 'p' and 'UNITID' in table_types:
+        connection.execute(sa.text(f"CREATE INDEX IF NOT EXISTS {_quote(table_name + '_unitid')} ON {_quote(table_name)} (\"UNITID\")"))
+    return table_types
+
+# function to add the columns of the partitioned table that the staging table is missing
+def _add_missing_columns(connection, table_name, staging):
+    staging_types = _table_types(connection, staging)
+    query = ("select attname, format_type(atttypid, atttypmod) from pg_attribute "
+             "where attrelid = to_regclass(:name) and attnum > 0 and not attisdropped order by attnum")
+    for column, sql_type in connection.execute(sa.text(query), {'name': _quote(table_name)}).fetchall():
+        if column not in staging_types:
+            connection.execute(sa.text(f"ALTER TABLE {_quote(staging)} ADD COLUMN {_quote(column)} {sql_type}"))
+
+def _table_types(connection, table_name):
+    query = "select column_name, data_type from information_schema.columns where table_schema = current_schema() and table_name = :table_name"
+    return dict(connection.execute(sa.text(query), {'table_name': table_name}).fetchall())
+
+# function to get the kind of a table: 'r' table, 'p' partitioned table, None when it does not exist
+def _relkind(connection, table_name):
+    query = "select relkind from pg_class where oid = to_regclass(:name)"
+    return connection.execute(sa.text(query), {'name': _quote(table_name)}).scalar()
+
+def _partition_name(table_name, year):
+    return f"{table_name}_{year}"
+
+def _staging_name(table_name, year):
+    return f"{table_name}_{year}_stage"
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+# function to create the table, or add the columns it is missing, and return its column types
+def _create_table(connection, table_name, columns, df, column_types=None):
+    table_types = _table_types(connection, table_name)
+    if not table_types:
+        table_types = {column: _column_type(column, df, column_types) for column in columns}
+        definition = ', '.join(f"{_quote(column)} {sql_type}" for column, sql_type in table_types.items())
+        connection.execute(sa.text(f"CREATE TABLE {_quote(table_name)} ({definition})"))
+        logger.info(f"Created postgres table {table_name}")
+    for column in columns:
+        if column not in table_types:
+            table_types[column] = _column_type(column, df, column_types)
+            connection.execute(sa.text(f"ALTER TABLE {_quote(table_name)} ADD COLUMN {_quote(column)} {table_types[column]}"))
+            logger.info(f"Added column {column} to postgres table {table_name}")
+    return table_types
+
+# function to get the postgres type of a new column
+# with column_types the type is fixed by the vartable DataType merged over the years, whatever the frame that
+# creates the column: 'N' columns are double precision (UNITID bigint), the 'A' columns, the labels and Year are text,
+# so every year fits the column; tables without a vartable (the metadata tables) take the type of the df column
+def _column_type(column, df, column_types=None):
+    if column_types is not None:
+        if column_types.get(column) == 'N':
+            return 'bigint' if column == 'UNITID' else 'double precision'
+        return 'text'
+    return _sql_type(df[column].dtype) if column in df.columns else 'text'
+
+# function to map a pandas dtype to the postgres column type, like to_sql does
+def _sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'bigint'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'double precision'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'timestamp'
+    return 'text'
+
+# function to prepare the df for COPY
+# a column created as bigint may come as float64 in a year with missing values,
+# whole floats are written as integers so postgres accepts them, the sparse columns of a year without the column are empty
+def _copy_frame(df, table_types):
+    converted = {}
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.SparseDtype):
+            continue
+        if table_types.get(column) in ('bigint', 'integer', 'smallint') and pd.api.types.is_float_dtype(df[column].dtype):
+            values = df[column].dropna()
+            if (values == values.round()).all():
+                converted[column] = df[column].astype('Int64')
+    return df.assign(**converted) if converted else df
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
@@ -0,0 +1,164 @@
+import cProfile
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# the run report gives the time of every stage of every (year, survey_table) unit
+# every unit keeps {'stages': {stage: {seconds, rows, columns, bytes, peak_rss_mb, memory_mb}}} next to its counts,
+# so the stages measured in the worker processes come back with the units; stages of the main process
+# (the combined CSVs, the CIPs and counts.csv) are kept in records with the same layout
+# memory_mb is the memory the frames of the table take once the labels are decoded (label decode)
+STAGE_COLUMNS = ['year', 'survey_table', 'status', 'stage', 'seconds', 'rows', 'columns', 'bytes', 'peak_rss_mb', 'memory_mb']
+
+# function to measure a stage, the times of the calls with the same stage are added up
+# rows and columns are taken from df when it is given and the stage succeeds, otherwise the caller sets them on the yielded entry
+# peak_rss_mb is the highest resident memory of the process while the stage of the unit ran (see track_peak_rss),
+# so the spikes inside read_sql and to_csv are included and every unit gets its own peak
+@contextmanager
+def measure(stages, stage, df=None):
+    entry = stages.setdefault(stage, {'seconds': 0.0, 'rows': 0, 'columns': 0, 'bytes': 0, 'peak_rss_mb': 0.0, 'memory_mb': 0.0})
+    start = time.perf_counter()
+    with track_peak_rss() as peak:
+        try:
+            yield entry
+            if df is not None:
+                entry['rows'] += len(df)
+                entry['columns'] = max(entry['columns'], len(df.columns))
+        finally:
+            entry['seconds'] += time.perf_counter() - start
+    entry['peak_rss_mb'] = max(entry['peak_rss_mb'], round(peak['peak_mb'], 1))
+
+# function to measure the reading of the chunks of a table, the time spent fetching every chunk is added to the stage
+def measure_chunks(stages, stage, chunks):
+    chunks = iter(chunks)
+    while True:
+        with measure(stages, stage) as entry:
+            df = next(chunks, None)
+            if df is not None:
+                entry['rows'] += len(df)
+                entry['columns'] = max(entry['columns'], len(df.columns))
+        if df is None:
+            return
+        yield df
+
+# the resident memory is sampled every SAMPLE_INTERVAL seconds by one thread of the process while stages are measured,
+# and every measured block keeps the highest sample taken while it ran; the high-water mark kept by the OS only goes up,
+# so it would give every table after the largest one of a worker the peak of that table
+SAMPLE_INTERVAL = 0.01
+# the blocks being measured by id and the sampling thread with the pid of its process, a forked worker starts its own
+_windows = {}
+_sampler = {'pid': None}
+
+def _sample():
+    process = psutil.Process()
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        windows = list(_windows.copy().values())
+        if windows:
+            rss = process.memory_info().rss
+            for window in windows:
+                window['rss'] = max(window['rss'], rss)
+
+# function to track the peak resident memory of the process while the block runs, in MB in the 'peak_mb' of the yielded dict
+# used by measure and by the benchmark, so both give the same peak
+@contextmanager
+def track_peak_rss():
+    process = psutil.Process()
+    if _sampler['pid'] != os.getpid():
+        _sampler['pid'] = os.getpid()
+        threading.Thread(target=_sample, daemon=True).start()
+    window = {'rss': process.memory_info().rss}
+    _windows[id(window)] = window
+    try:
+        yield window
+    finally:
+        del _windows[id(window)]
+        window['peak_mb'] = max(window['rss'], process.memory_info().rss) / 2**20
+
+# function to get the memory a dataframe takes in MB, the strings of object columns included
+# sparse columns count the values they store (memory_usage cannot measure sparse object columns)
+def frame_mb(df):
+    size = sum(series.array.nbytes if isinstance(series.dtype, pd.SparseDtype) else series.memory_usage(index=False, deep=True)
+               for column, series in df.items())
+    return size / 2**20
+
+# function to get the size of a file, 0 when it does not exist yet
+def file_size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+# function to profile the tables of a survey_table with cProfile, profilers is None when profiling is off
+@contextmanager
+def profile(profilers, survey_table):
+    if profilers is None:
+        yield
+        return
+    profiler = profilers.setdefault(survey_table, cProfile.Profile())
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+def profile_path(profile_folder, year, survey_table):
+    return os.path.join(profile_folder, f"{year}_{survey_table}.prof")
+
+# function to write the profiles of the survey_tables of a year
+def dump_profiles(profilers, profile_folder, year):
+    os.makedirs(profile_folder, exist_ok=True)
+    for survey_table, profiler in profilers.items():
+        profiler.dump_stats(profile_path(profile_folder, year, survey_table))
+
+# function to keep the profiles of the slowest units of the run and remove the others
+def prune_profiles(profile_folder, units, top):
+    units = sorted(units, key=unit_seconds, reverse=True)
+    kept = []
+    for position, unit in enumerate(units):
+        path = profile_path(profile_folder, unit['year'], unit['survey_table'])
+        if position < top and os.path.isfile(path):
+            kept.append(path)
+        elif os.path.isfile(path):
+            os.remove(path)
+    return kept
+
+def unit_seconds(unit):
+    return sum(entry['seconds'] for entry in unit.get('stages', {}).values())
+
+# function to write the report of the run as JSON and, next to it with a .csv extension, one row per unit and stage
+# skipped units are listed without their stages, those were measured in an earlier run
+def save_report(report_path, units, records, started, profiles=[]):
+    units = [dict(unit, stages={}) if unit['status'] == 'skipped' else unit for unit in units] + records
+    totals = {}
+    for unit in units:
+        for stage, entry in unit.get('stages', {}).items():
+            total = totals.setdefault(stage, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'peak_rss_mb': 0.0, 'memory_mb': 0.0})
+            total['seconds'] += entry['seconds']
+            total['rows'] += entry['rows']
+            total['bytes'] += entry['bytes']
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], entry['peak_rss_mb'])
+            total['memory_mb'] += entry['memory_mb']
+    report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+              'seconds': round(time.time() - started, 3),
+              'stages': totals,
+              'units': [{'year': unit['year'], 'survey_table': unit['survey_table'], 'status': unit['status'],
+                         'seconds': round(unit_seconds(unit), 4), 'stages': unit.get('stages', {})}
+                        for unit in sorted(units, key=unit_seconds, reverse=True)],
+              'profiles': profiles}
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+
+    with open(os.path.splitext(report_path)[0] + '.csv', 'w', newline='') as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(STAGE_COLUMNS)
+        for unit in units:
+            for stage, entry in unit.get('stages', {}).items():
+                writer.writerow([unit['year'], unit['survey_table'], unit['status'], stage, round(entry['seconds'], 4),
+                                 entry['rows'], entry['columns'], entry['bytes'], entry['peak_rss_mb'], round(entry['memory_mb'], 3)])
+    logger.info(f"Run report written to {report_path}")
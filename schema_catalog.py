@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import database_operations as db
+
+logger = logging.getLogger(__name__)
+
+# the schema catalog keeps the table columns of every Access file between runs
+# {'version': 3, 'files': {file path: {size, mtime, year, tables: [[survey_table, columns, discrete varnames, data types, field widths]]}}}
+# a file is only opened for schema discovery when it is new or its size or mtime changed
+CATALOG_VERSION = 3
+
+# function to read the schema catalog, an empty catalog is returned on the first run
+def load_catalog(catalog_path):
+    if os.path.isfile(catalog_path):
+        with open(catalog_path) as catalog_file:
+            catalog = json.load(catalog_file)
+        if catalog.get('version') == CATALOG_VERSION:
+            return catalog
+        logger.info(f"Schema catalog {catalog_path} has an old version, discovering all the files again")
+    return {'version': CATALOG_VERSION, 'files': {}}
+
+# function to write the schema catalog, only the files seen in this run are kept
+def save_catalog(catalog, catalog_path, file_paths):
+    catalog = {'version': CATALOG_VERSION,
+               'files': {path: entry for path, entry in catalog['files'].items() if path in file_paths}}
+    temp_path = catalog_path + '.tmp'
+    with open(temp_path, 'w') as catalog_file:
+        json.dump(catalog, catalog_file)
+    os.replace(temp_path, catalog_path)
+
+# function to get the table columns of an Access file from the catalog
+# the file is opened only when the catalog has no entry for its current size and mtime
+def get_table_columns(catalog, db_file, year):
+    stat = os.stat(db_file)
+    entry = catalog['files'].get(db_file)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime and entry['year'] == year:
+        logger.info(f"Table columns for {year} read from the schema catalog")
+        return entry['tables']
+    table_columns = db.get_table_columns(db_file, year)
+    if table_columns is None:
+        return []
+    catalog['files'][db_file] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'year': year, 'tables': table_columns}
+    return table_columns
+
+# function to merge the table columns of all the files into the columnList of every survey_table
+# key = survey name_table name, value = list of columns
+# the columns are kept in an ordered set (a dict) in the order they are first seen, and every
+# discrete varname is followed by its label column
+def merge_table_columns(table_columns):
+    columns = {}
+    labels = {}
+    for survey_table, new_columns, categorical_varnames, datatypes, widths in table_columns:
+        columns.setdefault(survey_table, {}).update(dict.fromkeys(new_columns))
+        labels.setdefault(survey_table, set()).update(categorical_varnames)
+    columnList = {}
+    for survey_table, ordered_columns in columns.items():
+        columnList[survey_table] = []
+        for column in ordered_columns:
+            columnList[survey_table].append(column)
+            if column in labels[survey_table] and column + '_label' not in ordered_columns:
+                columnList[survey_table].append(column + '_label')
+    return columnList
+
+# function to merge the vartable data types of all the files into one data type per column of a survey_table
+# a column that is alphanumeric ('A') in any year stays alphanumeric, so every year fits the same schema
+def merge_column_types(table_columns):
+    columnTypes = {}
+    for survey_table, new_columns, categorical_varnames, datatypes, widths in table_columns:
+        types = columnTypes.setdefault(survey_table, {})
+        for column, datatype in datatypes.items():
+            if types.get(column) != 'A':
+                types[column] = datatype
+    return columnTypes
+
+# function to build the dtype plan of every survey_table from the vartable metadata of all the files
+# key = survey name_table name, value = {column: pandas dtype the column is converted to when it is read}
+# discrete numeric codes become nullable integers just wide enough for their Fieldwidth (the widest of the years),
+# discrete alphanumeric codes become categoricals and UNITID a nullable int32; continuous and free text columns
+# are kept as read, and a column that is alphanumeric in any year is not converted to a number
+def merge_dtype_plan(table_columns):
+    datatypes = merge_column_types(table_columns)
+    discrete = {}
+    field_widths = {}
+    for survey_table, new_columns, categorical_varnames, types, widths in table_columns:
+        discrete.setdefault(survey_table, set()).update(categorical_varnames)
+        table_widths = field_widths.setdefault(survey_table, {})
+        for column, width in widths.items():
+            table_widths[column] = max(table_widths.get(column, 0), width)
+    dtypePlan = {}
+    for survey_table, types in datatypes.items():
+        plan = dtypePlan.setdefault(survey_table, {})
+        for column, datatype in types.items():
+            if column == 'UNITID':
+                plan[column] = 'Int32'
+            elif column not in discrete[survey_table]:
+                continue
+            elif datatype == 'A':
+                plan[column] = 'category'
+            elif datatype == 'N' and column in field_widths[survey_table]:
+                plan[column] = _integer_dtype(field_widths[survey_table][column])
+    return dtypePlan
+
+# function to get the smallest nullable integer dtype holding the values of a Fieldwidth, the sign included
+def _integer_dtype(width):
+    if width <= 2:
+        return 'Int8'
+    if width <= 4:
+        return 'Int16'
+    if width <= 9:
+        return 'Int32'
+    return 'Int64'
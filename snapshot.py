@@ -0,0 +1,86 @@
+import logging
+import os
+import pandas as pd
+import sqlalchemy as sa
+import database_operations as db
+from file_operations import iterate_folder
+
+logger = logging.getLogger(__name__)
+
+# a snapshot is a one-time export of every table of an Access file to a SQLite file with the same name,
+# e.g. IPEDS202122.accdb -> IPEDS202122.sqlite; later runs read the snapshots in bulk through sqlite instead
+# of fetching every row through the ODBC driver, and the snapshots can be read on hosts without Access
+# the size and mtime of the Access file are kept in the snapshot_source table, a changed file is exported again
+SNAPSHOT_EXTENSION = '.sqlite'
+
+def get_snapshot_path(snapshot_folder, db_file):
+    return os.path.join(snapshot_folder, os.path.splitext(os.path.basename(db_file))[0] + SNAPSHOT_EXTENSION)
+
+# function to check if the snapshot was exported from the current version of the Access file
+def is_snapshot_current(snapshot_path, db_file):
+    if not os.path.isfile(snapshot_path):
+        return False
+    stat = os.stat(db_file)
+    engine = sa.create_engine('sqlite:///' + snapshot_path)
+    try:
+        source = pd.read_sql("SELECT size, mtime FROM snapshot_source", engine)
+        return len(source) == 1 and source['size'][0] == stat.st_size and source['mtime'][0] == stat.st_mtime
+    except Exception:
+        return False
+    finally:
+        engine.dispose()
+
+# function to export every table of an Access file to its snapshot
+# the snapshot is written aside and moved in place once complete, chunk_size rows are copied at a time
+def export_snapshot(db_file, snapshot_path, chunk_size=50000):
+    source = db.connect_to_database(db_file)
+    if source is None:
+        return False
+    temp_path = snapshot_path + '.tmp'
+    if os.path.isfile(temp_path):
+        os.remove(temp_path)
+    target = sa.create_engine('sqlite:///' + temp_path)
+    try:
+        stat = os.stat(db_file)
+        table_names = sa.inspect(source).get_table_names()
+        with source.connect() as connection:
+            for table_name in table_names:
+                rows = 0
+                for df in pd.read_sql(f"SELECT * FROM {_quote(table_name)}", connection, chunksize=chunk_size):
+                    df.to_sql(table_name, target, index=False, if_exists='append')
+                    rows += len(df)
+                logger.debug(f"Exported {rows} rows of {table_name} to the snapshot")
+        pd.DataFrame([[db_file, stat.st_size, stat.st_mtime]], columns=['path', 'size', 'mtime']).to_sql(
+            'snapshot_source', target, index=False)
+        target.dispose()
+        os.replace(temp_path, snapshot_path)
+        logger.info(f"Snapshot {snapshot_path} exported with {len(table_names)} tables")
+        return True
+    except Exception as e:
+        logger.error(f"An error occurred while exporting {db_file} to a snapshot: {e}")
+        target.dispose()
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        return False
+    finally:
+        source.dispose()
+
+# function to export the Access files of the folder that are new or changed since their snapshot
+# returns the Access files without a current snapshot, e.g. without the Access ODBC driver (on Linux) the export fails,
+# the caller reads them through the ODBC backend instead of a missing or stale snapshot
+def update_snapshots(accessdb_folderpath, snapshot_folderpath):
+    os.makedirs(snapshot_folderpath, exist_ok=True)
+    stale_files = []
+    for file in iterate_folder(accessdb_folderpath, file_extension=".accdb"):
+        snapshot_path = get_snapshot_path(snapshot_folderpath, file)
+        if is_snapshot_current(snapshot_path, file):
+            logger.info(f"Snapshot of {file} is up to date")
+            continue
+        logger.info(f"Exporting {file} to the snapshot {snapshot_path}")
+        if not export_snapshot(file, snapshot_path):
+            stale_files.append(file)
+    return stale_files
+
+# function to quote a table name for the Access SQL dialect, e.g. a table name with a space or a reserved word
+def _quote(table_name):
+    return '[' + table_name.replace(']', ']]') + ']'